@@ -0,0 +1,31 @@
+"""users unread message counter
+
+Revision ID: 0a6b8c3d5e24
+Revises: f4a7c2d9e016
+Create Date: 2026-10-18 17:35:40.882315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6b8c3d5e24'
+down_revision = 'f4a7c2d9e016'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE users SET unread_count = (
+            SELECT count(*) FROM messages
+            WHERE messages.user_receiver = users.id AND messages.review_date IS NULL
+        )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('unread_count')
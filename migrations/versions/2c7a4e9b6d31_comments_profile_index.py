@@ -0,0 +1,24 @@
+"""comments profile listing index
+
+Revision ID: 2c7a4e9b6d31
+Revises: 9f1d6b3e8a45
+Create Date: 2026-10-18 20:36:51.884102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c7a4e9b6d31'
+down_revision = '9f1d6b3e8a45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_comments_profile_user_id_created_at', 'comments', ['profile_user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_profile_user_id_created_at', table_name='comments')
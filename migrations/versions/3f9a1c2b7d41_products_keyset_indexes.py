@@ -0,0 +1,34 @@
+"""products keyset pagination indexes
+
+Revision ID: 3f9a1c2b7d41
+Revises: 6c31196ff2d5
+Create Date: 2026-10-18 09:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2b7d41'
+down_revision = '6c31196ff2d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # La paginación por cursor ordena por (created_at, id): created_at no puede ser NULL
+    op.execute("UPDATE products SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.alter_column('created_at',
+               existing_type=sa.DateTime(),
+               nullable=False)
+        batch_op.create_index('ix_products_available_created_at_id', ['available', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('ix_products_available_created_at_id')
+        batch_op.alter_column('created_at',
+               existing_type=sa.DateTime(),
+               nullable=True)
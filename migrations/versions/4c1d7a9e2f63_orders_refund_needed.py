@@ -0,0 +1,33 @@
+"""refund_needed order status
+
+Revision ID: 4c1d7a9e2f63
+Revises: 8a4f1e7c3b50
+Create Date: 2026-10-18 23:12:05.604218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1d7a9e2f63'
+down_revision = '8a4f1e7c3b50'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # En SQLite el Enum es un VARCHAR sin CHECK; solo PostgreSQL tiene el tipo `status`
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute("ALTER TYPE status ADD VALUE IF NOT EXISTS 'refund_needed'")
+
+
+def downgrade():
+    op.execute("UPDATE orders SET status = 'canceled' WHERE status = 'refund_needed'")
+    if op.get_bind().dialect.name == 'postgresql':
+        # PostgreSQL no permite quitar valores de un enum: se recrea el tipo
+        op.execute("ALTER TYPE status RENAME TO status_old")
+        sa.Enum('pending', 'close', 'paid', 'canceled', name='status').create(op.get_bind())
+        op.execute("ALTER TABLE orders ALTER COLUMN status TYPE status USING status::text::status")
+        op.execute("DROP TYPE status_old")
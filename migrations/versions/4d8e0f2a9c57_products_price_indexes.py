@@ -0,0 +1,27 @@
+"""products price filter and sort indexes
+
+Revision ID: 4d8e0f2a9c57
+Revises: c71d93e5b820
+Create Date: 2026-10-18 12:02:44.310958
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d8e0f2a9c57'
+down_revision = 'c71d93e5b820'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # (available, created_at, id) ya existe desde 3f9a1c2b7d41 y cubre sort=recent/oldest y since
+    op.create_index('ix_products_available_price_id', 'products', ['available', 'price', 'id'], unique=False)
+    op.create_index('ix_products_available_category_price', 'products', ['available', 'category', 'price', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_products_available_category_price', table_name='products')
+    op.drop_index('ix_products_available_price_id', table_name='products')
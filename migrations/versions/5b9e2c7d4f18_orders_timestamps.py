@@ -0,0 +1,29 @@
+"""orders timestamps as datetime and nullable paid_at
+
+Revision ID: 5b9e2c7d4f18
+Revises: d3c8e1f5a7b2
+Create Date: 2026-10-18 19:48:02.653771
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9e2c7d4f18'
+down_revision = 'd3c8e1f5a7b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.alter_column('created_at', existing_type=sa.Date(), type_=sa.DateTime(), existing_nullable=False)
+        batch_op.alter_column('paid_at', existing_type=sa.Date(), type_=sa.DateTime(), nullable=True)
+
+
+def downgrade():
+    op.execute("UPDATE orders SET paid_at = created_at WHERE paid_at IS NULL")
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.alter_column('paid_at', existing_type=sa.DateTime(), type_=sa.Date(), nullable=False)
+        batch_op.alter_column('created_at', existing_type=sa.DateTime(), type_=sa.Date(), existing_nullable=False)
@@ -0,0 +1,35 @@
+"""favorites unique user and product
+
+Revision ID: 6e0f3a8c2b97
+Revises: 2c7a4e9b6d31
+Create Date: 2026-10-18 21:02:19.540663
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e0f3a8c2b97'
+down_revision = '2c7a4e9b6d31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Elimina los duplicados que pudo dejar el antiguo select-then-insert (se conserva el más antiguo)
+    op.execute("""
+        DELETE FROM favorites WHERE id NOT IN (
+            SELECT min(id) FROM favorites GROUP BY user_id, product_id
+        )
+    """)
+    op.execute("""
+        UPDATE product_cards SET favorite_count = (
+            SELECT count(*) FROM favorites WHERE favorites.product_id = product_cards.product_id
+        )
+    """)
+    op.create_index('uq_favorites_user_id_product_id', 'favorites', ['user_id', 'product_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_favorites_user_id_product_id', table_name='favorites')
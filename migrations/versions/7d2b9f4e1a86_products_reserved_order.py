@@ -0,0 +1,33 @@
+"""order that holds each product reservation
+
+Revision ID: 7d2b9f4e1a86
+Revises: 4c1d7a9e2f63
+Create Date: 2026-10-18 23:48:31.270915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2b9f4e1a86'
+down_revision = '4c1d7a9e2f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Sin batch_alter_table: en SQLite recrearía products y perdería los triggers de products_fts
+    op.add_column('products', sa.Column('reserved_order_id', sa.Integer(), nullable=True))
+    # Las reservas existentes pasan al pedido pendiente más reciente que contiene el producto
+    op.execute("""
+        UPDATE products SET reserved_order_id = (
+            SELECT max(orders.id) FROM orders JOIN order_items ON order_items.order_id = orders.id
+            WHERE order_items.product_id = products.id AND orders.status = 'pending'
+        )
+        WHERE available = false AND (was_sold = false OR was_sold IS NULL)
+    """)
+
+
+def downgrade():
+    op.drop_column('products', 'reserved_order_id')
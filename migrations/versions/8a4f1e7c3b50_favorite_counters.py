@@ -0,0 +1,50 @@
+"""favorite counters and trending score
+
+Revision ID: 8a4f1e7c3b50
+Revises: 6e0f3a8c2b97
+Create Date: 2026-10-18 21:40:27.906114
+
+"""
+import math
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4f1e7c3b50'
+down_revision = '6e0f3a8c2b97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # add_column/create_index sin batch: recrear products en SQLite borraría los triggers de FTS5
+    op.add_column('products', sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('products', sa.Column('trending_score', sa.Float(), server_default='0', nullable=False))
+    op.add_column('favorites', sa.Column('created_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_products_available_favorite_count_id', 'products', ['available', 'favorite_count', 'id'], unique=False)
+    op.create_index('ix_products_available_trending_score_id', 'products', ['available', 'trending_score', 'id'], unique=False)
+
+    op.execute("""
+        UPDATE products SET favorite_count = (
+            SELECT count(*) FROM favorites WHERE favorites.product_id = products.id
+        )
+    """)
+    # Los favoritos existentes no tienen fecha: se les asigna 2025-01-01 (LEGACY_FAVORITE_DATE en
+    # api.favorites). Con todos en el mismo instante la puntuación es exponente + ln(número de favoritos)
+    op.execute("UPDATE favorites SET created_at = '2025-01-01 00:00:00' WHERE created_at IS NULL")
+    legacy_exponent = (datetime(2025, 1, 1) - datetime(2020, 1, 1)).total_seconds() / (3 * 86400 / math.log(2))
+    bind = op.get_bind()
+    for product_id, count in bind.execute(sa.text(
+            "SELECT product_id, count(*) FROM favorites WHERE product_id IS NOT NULL GROUP BY product_id")).all():
+        bind.execute(sa.text("UPDATE products SET trending_score = :score WHERE id = :id"),
+                     {'score': legacy_exponent + math.log(count), 'id': product_id})
+
+def downgrade():
+    op.drop_index('ix_products_available_trending_score_id', table_name='products')
+    op.drop_index('ix_products_available_favorite_count_id', table_name='products')
+    with op.batch_alter_table('favorites', schema=None) as batch_op:
+        batch_op.drop_column('created_at')
+    op.drop_column('products', 'trending_score')
+    op.drop_column('products', 'favorite_count')
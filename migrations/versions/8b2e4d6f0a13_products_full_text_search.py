@@ -0,0 +1,92 @@
+"""products full text search
+
+Revision ID: 8b2e4d6f0a13
+Revises: 3f9a1c2b7d41
+Create Date: 2026-10-18 10:04:52.118530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6f0a13'
+down_revision = '3f9a1c2b7d41'
+branch_labels = None
+depends_on = None
+
+PG_DOCUMENT = """
+    setweight(to_tsvector('spanish', coalesce({row}title, '')), 'A') ||
+    setweight(to_tsvector('spanish', coalesce({row}category::text, '')), 'B') ||
+    setweight(to_tsvector('spanish', coalesce({row}description, '')), 'C')
+"""
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    op.add_column('products', sa.Column('search_vector', sa.Text().with_variant(postgresql.TSVECTOR(), 'postgresql'), nullable=True))
+
+    if dialect == 'postgresql':
+        op.execute(f"""
+            CREATE FUNCTION products_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {PG_DOCUMENT.format(row='NEW.')};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        op.execute("""
+            CREATE TRIGGER products_search_vector_trigger
+            BEFORE INSERT OR UPDATE OF title, description, category ON products
+            FOR EACH ROW EXECUTE PROCEDURE products_search_vector_update()
+        """)
+        op.execute(f"UPDATE products SET search_vector = {PG_DOCUMENT.format(row='')}")
+        op.create_index('ix_products_search_vector', 'products', ['search_vector'], unique=False, postgresql_using='gin')
+
+    elif dialect == 'sqlite':
+        # Tabla FTS5 de contenido externo sincronizada con triggers. Ojo: batch_alter_table sobre
+        # products recrea la tabla y elimina estos triggers.
+        op.execute("""
+            CREATE VIRTUAL TABLE products_fts USING fts5(
+                title, description, category,
+                content='products', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        op.execute("""
+            CREATE TRIGGER products_fts_ai AFTER INSERT ON products BEGIN
+                INSERT INTO products_fts(rowid, title, description, category)
+                VALUES (new.id, new.title, new.description, new.category);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER products_fts_ad AFTER DELETE ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, title, description, category)
+                VALUES ('delete', old.id, old.title, old.description, old.category);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER products_fts_au AFTER UPDATE OF title, description, category ON products BEGIN
+                INSERT INTO products_fts(products_fts, rowid, title, description, category)
+                VALUES ('delete', old.id, old.title, old.description, old.category);
+                INSERT INTO products_fts(rowid, title, description, category)
+                VALUES (new.id, new.title, new.description, new.category);
+            END
+        """)
+        op.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_products_search_vector', table_name='products')
+        op.execute("DROP TRIGGER products_search_vector_trigger ON products")
+        op.execute("DROP FUNCTION products_search_vector_update()")
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER products_fts_au")
+        op.execute("DROP TRIGGER products_fts_ad")
+        op.execute("DROP TRIGGER products_fts_ai")
+        op.execute("DROP TABLE products_fts")
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('search_vector')
@@ -0,0 +1,24 @@
+"""orders history index
+
+Revision ID: 9f1d6b3e8a45
+Revises: 5b9e2c7d4f18
+Create Date: 2026-10-18 20:14:36.207519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f1d6b3e8a45'
+down_revision = '5b9e2c7d4f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_orders_user_id_created_at', 'orders', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_orders_user_id_created_at', table_name='orders')
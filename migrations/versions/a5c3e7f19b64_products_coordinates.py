@@ -0,0 +1,31 @@
+"""products coordinates and geohash
+
+Revision ID: a5c3e7f19b64
+Revises: 4d8e0f2a9c57
+Create Date: 2026-10-18 13:15:20.771043
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5c3e7f19b64'
+down_revision = '4d8e0f2a9c57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Sin batch_alter_table: en SQLite recrearía products y perdería los triggers de products_fts
+    op.add_column('products', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('products', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('products', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index(op.f('ix_products_geohash'), 'products', ['geohash'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_products_geohash'), table_name='products')
+    op.drop_column('products', 'geohash')
+    op.drop_column('products', 'longitude')
+    op.drop_column('products', 'latitude')
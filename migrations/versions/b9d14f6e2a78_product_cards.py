@@ -0,0 +1,64 @@
+"""product_cards listing read model
+
+Revision ID: b9d14f6e2a78
+Revises: e2f6a8b4c913
+Create Date: 2026-10-18 15:30:12.557804
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9d14f6e2a78'
+down_revision = 'e2f6a8b4c913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_cards',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(length=120), nullable=False),
+    sa.Column('excerpt', sa.String(length=160), nullable=True),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('location', sa.String(length=120), nullable=True),
+    sa.Column('latitude', sa.Float(), nullable=True),
+    sa.Column('longitude', sa.Float(), nullable=True),
+    sa.Column('thumbnail_url', sa.String(), nullable=True),
+    sa.Column('tags', sa.String(length=20), nullable=False),
+    sa.Column('category', sa.String(length=60), nullable=False),
+    sa.Column('available', sa.Boolean(), nullable=False),
+    sa.Column('was_sold', sa.Boolean(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('seller_name', sa.String(length=241), nullable=True),
+    sa.Column('favorite_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+    op.create_index('ix_product_cards_user_id_created_at', 'product_cards', ['user_id', 'created_at'], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        thumbnail = "products.image_urls->>0"
+        text_cast = "::text"
+    else:
+        thumbnail = "json_extract(products.image_urls, '$[0]')"
+        text_cast = ""
+    op.execute(f"""
+        INSERT INTO product_cards (product_id, user_id, title, excerpt, price, location, latitude, longitude,
+                                   thumbnail_url, tags, category, available, was_sold, created_at,
+                                   seller_name, favorite_count)
+        SELECT products.id, products.user_id, products.title, substr(products.description, 1, 160),
+               products.price, products.location, products.latitude, products.longitude, {thumbnail},
+               products.tags{text_cast}, products.category{text_cast}, products.available, products.was_sold,
+               products.created_at, users.first_name || ' ' || users.last_name,
+               (SELECT count(*) FROM favorites WHERE favorites.product_id = products.id)
+        FROM products JOIN users ON users.id = products.user_id
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_product_cards_user_id_created_at', table_name='product_cards')
+    op.drop_table('product_cards')
@@ -0,0 +1,29 @@
+"""products title trigram index
+
+Revision ID: c71d93e5b820
+Revises: 8b2e4d6f0a13
+Create Date: 2026-10-18 11:27:09.645201
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71d93e5b820'
+down_revision = '8b2e4d6f0a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # En SQLite la búsqueda difusa usa un índice de trigramas en memoria (api/search.py)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.create_index('ix_products_title_trgm', 'products', ['title'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_products_title_trgm', table_name='products')
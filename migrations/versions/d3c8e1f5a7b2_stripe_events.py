@@ -0,0 +1,42 @@
+"""stripe events inbox and orders payment intent
+
+Revision ID: d3c8e1f5a7b2
+Revises: 7e3b5a9c1d62
+Create Date: 2026-10-18 19:05:47.118340
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3c8e1f5a7b2'
+down_revision = '7e3b5a9c1d62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stripe_events',
+    sa.Column('id', sa.String(length=255), nullable=False),
+    sa.Column('type', sa.String(length=100), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(length=20), server_default='pending', nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stripe_events_status_next_attempt_at', 'stripe_events', ['status', 'next_attempt_at'], unique=False)
+    op.add_column('orders', sa.Column('payment_intent_id', sa.String(length=255), nullable=True))
+    op.create_index('uq_orders_payment_intent_id', 'orders', ['payment_intent_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_orders_payment_intent_id', table_name='orders')
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_column('payment_intent_id')
+    op.drop_index('ix_stripe_events_status_next_attempt_at', table_name='stripe_events')
+    op.drop_table('stripe_events')
@@ -0,0 +1,31 @@
+"""row version and updated_at for products and users
+
+Revision ID: e2f6a8b4c913
+Revises: a5c3e7f19b64
+Create Date: 2026-10-18 14:41:57.093362
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f6a8b4c913'
+down_revision = 'a5c3e7f19b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('products', 'users'):
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE products SET updated_at = created_at")
+    op.execute("UPDATE users SET updated_at = CURRENT_TIMESTAMP")
+
+
+def downgrade():
+    # Sin batch_alter_table: en SQLite recrearía products y perdería los triggers de products_fts
+    for table in ('users', 'products'):
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'version')
@@ -0,0 +1,39 @@
+"""messages conversation key and inbox indexes
+
+Revision ID: f4a7c2d9e016
+Revises: b9d14f6e2a78
+Create Date: 2026-10-18 16:48:03.219477
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a7c2d9e016'
+down_revision = 'b9d14f6e2a78'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('messages', sa.Column('conversation_key', sa.String(length=40), nullable=True))
+    op.execute("""
+        UPDATE messages SET conversation_key = CASE
+            WHEN user_sender < user_receiver
+                THEN CAST(user_sender AS VARCHAR(20)) || ':' || CAST(user_receiver AS VARCHAR(20))
+            ELSE CAST(user_receiver AS VARCHAR(20)) || ':' || CAST(user_sender AS VARCHAR(20))
+        END
+        WHERE user_sender IS NOT NULL AND user_receiver IS NOT NULL
+    """)
+    op.create_index('ix_messages_user_receiver_created_at', 'messages', ['user_receiver', 'created_at'], unique=False)
+    op.create_index('ix_messages_user_sender_created_at', 'messages', ['user_sender', 'created_at'], unique=False)
+    op.create_index('ix_messages_conversation_key_created_at_id', 'messages', ['conversation_key', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_messages_conversation_key_created_at_id', table_name='messages')
+    op.drop_index('ix_messages_user_sender_created_at', table_name='messages')
+    op.drop_index('ix_messages_user_receiver_created_at', table_name='messages')
+    with op.batch_alter_table('messages', schema=None) as batch_op:
+        batch_op.drop_column('conversation_key')
@@ -0,0 +1,225 @@
+"""
+Caché de respuestas para las lecturas anónimas del catálogo (get_products, get_product,
+get_products_by_user_id). El backend por defecto es un LRU en memoria con TTL por proceso; con
+RESPONSE_CACHE_BACKEND=redis y REDIS_URL se comparte entre workers. La invalidación se hace al
+escribir productos: el listado usa un contador de generación y el detalle/vendedor claves propias.
+
+Los helpers de ETag/Last-Modified permiten contestar 304 sin volver a serializar.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import urlencode
+from flask import current_app, make_response, request
+
+
+class LocalCache:
+    """LRU en memoria con TTL. Los contadores de versión se guardan aparte y nunca se expulsan."""
+
+    def __init__(self, max_entries=1024, default_ttl=60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (ttl or self.default_ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def get_version(self, name):
+        with self._lock:
+            return self._versions.get(name, 0)
+
+    def bump_version(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            return self._versions[name]
+
+
+class RedisCache:
+    """Mismo interfaz que LocalCache sobre Redis (valores JSON con expiración)."""
+
+    def __init__(self, client, default_ttl=60, prefix='cache:'):
+        self.client = client
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or self.default_ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def get_version(self, name):
+        return int(self.client.get(self.prefix + 'version:' + name) or 0)
+
+    def bump_version(self, name):
+        return self.client.incr(self.prefix + 'version:' + name)
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def get_version(self, name):
+        return 0
+
+    def bump_version(self, name):
+        return 0
+
+
+def redis_client(url=None):
+    """Cliente Redis para REDIS_URL. `redis` es una dependencia opcional."""
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("El backend redis requiere instalar el paquete 'redis' (pipenv install redis).")
+    return redis.Redis.from_url(url or os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+
+
+def setup_cache(app, backend=None):
+    app.config.setdefault('RESPONSE_CACHE_BACKEND', os.getenv('RESPONSE_CACHE_BACKEND', 'local'))
+    app.config.setdefault('RESPONSE_CACHE_TTL', int(os.getenv('RESPONSE_CACHE_TTL', 60)))
+    app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1024)))
+    if backend is None:
+        name = app.config['RESPONSE_CACHE_BACKEND']
+        if name == 'redis':
+            backend = RedisCache(redis_client(), default_ttl=app.config['RESPONSE_CACHE_TTL'])
+        elif name == 'none':
+            backend = NullCache()
+        else:
+            backend = LocalCache(max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+                                 default_ttl=app.config['RESPONSE_CACHE_TTL'])
+    app.extensions['response_cache'] = backend
+
+
+def get_cache():
+    return current_app.extensions.get('response_cache') or NullCache()
+
+
+def normalized_args():
+    return urlencode(sorted(request.args.items(multi=True)))
+
+
+def catalog_key(**kwargs):
+    return f"catalog:{get_cache().get_version('catalog')}:{normalized_args()}"
+
+
+def trending_key(**kwargs):
+    return f"trending:{get_cache().get_version('catalog')}:{normalized_args()}"
+
+
+def product_key(product_id, **kwargs):
+    return f"product:{product_id}"
+
+
+def seller_key(user_id, **kwargs):
+    return f"seller:{user_id}"
+
+
+def not_modified(etag, last_modified=None):
+    """True si la petición condicional (If-None-Match / If-Modified-Since) ya tiene esta versión."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        since = request.if_modified_since
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def set_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return response
+
+
+def not_modified_response(etag, last_modified=None):
+    return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+
+def cached_response(key_func):
+    """
+    Cachea el cuerpo JSON y el ETag de las respuestas 200 de la vista y contesta 304 a las peticiones
+    condicionales que coinciden. Las peticiones autenticadas no usan la caché. `key_func` recibe los
+    argumentos de la ruta y devuelve la clave.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.headers.get('Authorization'):
+                return view(*args, **kwargs)
+            cache = get_cache()
+            key = key_func(**kwargs)
+            entry = cache.get(key)
+            if entry is not None:
+                last_modified = datetime.fromisoformat(entry['last_modified']) if entry.get('last_modified') else None
+                if not_modified(entry['etag'], last_modified):
+                    response = not_modified_response(entry['etag'], last_modified)
+                else:
+                    response = set_validators(
+                        current_app.response_class(entry['body'], status=200, mimetype='application/json'),
+                        entry['etag'], last_modified)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                # Sin ETag propio de la vista se usa un hash del contenido
+                if response.get_etag()[0] is None:
+                    response.add_etag()
+                last_modified = response.last_modified
+                cache.set(key, {
+                    'body': response.get_data(as_text=True),
+                    'etag': response.get_etag()[0],
+                    'last_modified': last_modified.replace(tzinfo=None).isoformat() if last_modified else None
+                })
+                response.make_conditional(request)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_product(product_id, user_id):
+    """Invalida listado, detalle y listado del vendedor tras crear, modificar, vender o borrar un producto."""
+    cache = get_cache()
+    cache.bump_version('catalog')
+    cache.delete(product_key(product_id), seller_key(user_id))
@@ -3,8 +3,22 @@ In this file, you can add as many commands as you want using the @app.cli.comman
 Flask commands are usefull to run cronjobs or tasks outside of the API but sill in integration 
 with youy database, for example: Import the price of bitcoin every night as 12am
 """
+import os
+import random
+import threading
+import time
+from datetime import datetime
 import click
-from api.models import db, Users
+from itertools import groupby
+from api.models import db, Users, Products, ProductCards, Messages, Orders, OrderItems, Favorites
+from sqlalchemy import func
+from api.mailer import send_pending
+from api.webhooks import process_pending
+from api.workers import PollingWorker
+from api.orders import place_order
+from api.utils import APIException
+from api.favorites import trending_score
+from api.passwords import PasswordHasher
 
 
 def setup_commands(app):
@@ -30,3 +44,170 @@ def setup_commands(app):
     @app.cli.command("insert-test-data")
     def insert_test_data():
         pass
+
+    @app.cli.command("rebuild-product-cards")
+    def rebuild_product_cards():
+        """Regenera la tabla product_cards a partir de products (p.ej. si se ha desincronizado)"""
+        print("Rebuilding product cards")
+        for product in Products.query.yield_per(500):
+            ProductCards.refresh(product)
+        db.session.commit()
+        print("Product cards rebuilt:", ProductCards.query.count())
+
+    @app.cli.command("reconcile-unread-counts")
+    def reconcile_unread_counts():
+        """Recalcula users.unread_count a partir de los mensajes sin leer"""
+        unread = db.session.query(func.count(Messages.id))\
+            .filter(Messages.user_receiver == Users.id, Messages.review_date.is_(None))\
+            .scalar_subquery()
+        updated = Users.query.update({Users.unread_count: unread}, synchronize_session=False)
+        db.session.commit()
+        print("Unread counts reconciled for", updated, "users")
+
+    @app.cli.command("reconcile-favorite-counts")
+    def reconcile_favorite_counts():
+        """Recalcula favorite_count y trending_score de products (y el contador de las tarjetas) a partir de favorites"""
+        counts = db.session.query(func.count(Favorites.id)).filter(Favorites.product_id == Products.id).scalar_subquery()
+        updated = Products.query.update({Products.favorite_count: counts, Products.trending_score: 0,
+                                         Products.updated_at: Products.updated_at}, synchronize_session=False)
+        rows = db.session.query(Favorites.product_id, Favorites.created_at)\
+            .order_by(Favorites.product_id).yield_per(1000)
+        scores = [(product_id, trending_score(created_at for _, created_at in group))
+                  for product_id, group in groupby(rows, key=lambda row: row.product_id)]
+        for product_id, score in scores:
+            Products.query.filter(Products.id == product_id).update(
+                {Products.trending_score: score, Products.updated_at: Products.updated_at}, synchronize_session=False)
+        card_counts = db.session.query(Products.favorite_count)\
+            .filter(Products.id == ProductCards.product_id).scalar_subquery()
+        ProductCards.query.update({ProductCards.favorite_count: card_counts}, synchronize_session=False)
+        db.session.commit()
+        print("Favorite counters reconciled for", updated, "products,", len(scores), "with favorites")
+
+    @app.cli.command("bench-passwords")
+    @click.option("--method", "methods", multiple=True,
+                  help="PASSWORD_HASH_METHOD a medir (repetible); por defecto el configurado y los habituales")
+    @click.option("--rounds", default=20, help="Verificaciones por configuración")
+    def bench_passwords(methods, rounds):
+        """Mide logins/s por núcleo (una verificación de contraseña por login) para cada configuración de hash"""
+        methods = methods or list(dict.fromkeys([
+            os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1'),
+            'scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:1000000', 'pbkdf2:sha256:600000', 'argon2']))
+        print(f"{'method':<28}{'ms/login':>10}{'logins/s/core':>15}")
+        for method in methods:
+            try:
+                hasher = PasswordHasher(method=method, workers=1)
+            except (RuntimeError, ValueError) as error:
+                print(f"{method:<28}  skipped: {error}")
+                continue
+            stored = hasher.hash('correct horse battery staple')
+            started = time.perf_counter()
+            for _ in range(rounds):
+                hasher.verify(stored, 'correct horse battery staple')
+            per_login = (time.perf_counter() - started) / rounds
+            print(f"{method:<28}{per_login * 1000:>10.1f}{1 / per_login:>15.1f}")
+
+    @app.cli.command("send-emails")
+    @click.option("--loop", is_flag=True, help="Sigue enviando indefinidamente (proceso worker dedicado)")
+    def send_emails(loop):
+        """Envía los correos pendientes del outbox"""
+        if loop:
+            worker = PollingWorker(app, 'mailer', send_pending, interval=float(os.getenv('EMAIL_POLL_INTERVAL', 10)))
+            print("Sending emails, press Ctrl+C to stop")
+            worker.run_forever()
+            return
+        sent = 0
+        while True:
+            processed = send_pending(app)
+            if not processed:
+                break
+            sent += processed
+        print("Emails processed:", sent)
+
+    @app.cli.command("process-stripe-events")
+    @click.option("--loop", is_flag=True, help="Sigue procesando indefinidamente (proceso worker dedicado)")
+    def process_stripe_events(loop):
+        """Procesa los eventos de Stripe pendientes del inbox"""
+        if loop:
+            worker = PollingWorker(app, 'stripe-events', process_pending,
+                                   interval=float(os.getenv('STRIPE_EVENTS_POLL_INTERVAL', 10)))
+            print("Processing Stripe events, press Ctrl+C to stop")
+            worker.run_forever()
+            return
+        processed = 0
+        while True:
+            batch = process_pending(app)
+            if not batch:
+                break
+            processed += batch
+        print("Stripe events processed:", processed)
+
+    @app.cli.command("bench-checkout")
+    @click.option("--buyers", default=20, help="Compradores concurrentes (un hilo por comprador)")
+    @click.option("--products", default=5, help="Productos de una unidad en disputa")
+    def bench_checkout(buyers, products):
+        """Compras concurrentes de los mismos productos con datos temporales; comprueba que cada
+        producto se vende una sola vez y mide pedidos/s"""
+        stamp = int(time.time())
+        seller = Users(first_name='Bench', last_name='Seller', email=f"bench-seller-{stamp}@example.com",
+                       password='-', role='vendedor')
+        users = [Users(first_name='Bench', last_name=f"Buyer {n}", email=f"bench-buyer-{stamp}-{n}@example.com",
+                       password='-', role='comprador') for n in range(buyers)]
+        db.session.add_all([seller] + users)
+        db.session.flush()
+        items = [Products(title=f"Bench {stamp} #{n}", description='-', price=10 + n, location='-', tags='used',
+                          category='Coches', user_id=seller.id, created_at=datetime.utcnow())
+                 for n in range(products)]
+        db.session.add_all(items)
+        db.session.flush()
+        for product in items:
+            ProductCards.refresh(product)
+        db.session.commit()
+        user_ids = [user.id for user in users] + [seller.id]
+        product_ids = [product.id for product in items]
+
+        results = []
+        barrier = threading.Barrier(buyers)
+
+        def checkout(buyer_id):
+            with app.app_context():
+                wanted = random.sample(product_ids, k=random.randint(1, len(product_ids)))
+                barrier.wait()
+                started = time.perf_counter()
+                try:
+                    place_order(buyer_id, wanted)
+                    outcome = 'ok'
+                except APIException:
+                    outcome = 'conflict'
+                except Exception:
+                    db.session.rollback()
+                    outcome = 'error'
+                results.append((outcome, time.perf_counter() - started))
+
+        try:
+            threads = [threading.Thread(target=checkout, args=(user_id,)) for user_id in user_ids[:-1]]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            latencies = sorted(latency for _, latency in results)
+            print("Checkouts:", len(results), "ok:", sum(1 for r in results if r[0] == 'ok'),
+                  "conflict:", sum(1 for r in results if r[0] == 'conflict'),
+                  "error:", sum(1 for r in results if r[0] == 'error'))
+            print(f"Elapsed: {elapsed:.3f}s ({len(results) / elapsed:.1f} checkouts/s), "
+                  f"p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms")
+            sold = db.session.query(OrderItems.product_id, func.count(OrderItems.id))\
+                .filter(OrderItems.product_id.in_(product_ids)).group_by(OrderItems.product_id).all()
+            print("Oversold products:", [product_id for product_id, count in sold if count > 1] or "none")
+        finally:
+            # Limpieza de los datos temporales
+            db.session.rollback()
+            order_ids = [order_id for (order_id,) in db.session.query(Orders.id).filter(Orders.user_id.in_(user_ids))]
+            OrderItems.query.filter(OrderItems.order_id.in_(order_ids)).delete(synchronize_session=False)
+            Orders.query.filter(Orders.id.in_(order_ids)).delete(synchronize_session=False)
+            ProductCards.query.filter(ProductCards.product_id.in_(product_ids)).delete(synchronize_session=False)
+            Products.query.filter(Products.id.in_(product_ids)).delete(synchronize_session=False)
+            Users.query.filter(Users.id.in_(user_ids)).delete(synchronize_session=False)
+            db.session.commit()
@@ -0,0 +1,109 @@
+"""
+Favoritos por usuario. El conjunto {product_id: favorite_id} de cada usuario se guarda en la caché de
+respuestas (clave favorites:<user_id>) para contestar las comprobaciones del listado sin ir a la base
+de datos; se invalida en cada alta o baja. Las altas usan INSERT ... ON CONFLICT DO NOTHING sobre el
+índice único (user_id, product_id).
+
+Popularidad: products.favorite_count se mantiene con UPDATE incrementales y products.trending_score es
+la suma de exp((t - TRENDING_EPOCH) / TRENDING_TAU) de cada favorito guardada en espacio logarítmico.
+Como el decaimiento común a todos los productos no cambia el orden, basta con sumar (logaddexp) al
+añadir y restar al quitar: ordenar por tendencia es un recorrido del índice (available, trending_score).
+"""
+import math
+import os
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from api.cache import get_cache
+from api.models import db, Favorites, Products
+from api.search import dialect_name
+
+FAVORITES_CACHE_TTL = int(os.getenv('FAVORITES_CACHE_TTL', 30))
+UPSERT_INSERTS = {'postgresql': postgresql_insert, 'sqlite': sqlite_insert}
+
+TRENDING_EPOCH = datetime(2020, 1, 1)
+LEGACY_FAVORITE_DATE = datetime(2025, 1, 1)  # fecha asignada a los favoritos anteriores a created_at
+TRENDING_HALF_LIFE = timedelta(days=3)
+TRENDING_TAU = TRENDING_HALF_LIFE.total_seconds() / math.log(2)
+
+
+def favorites_key(user_id):
+    return f"favorites:{user_id}"
+
+
+def favorite_map(user_id):
+    """{product_id: favorite_id} con todos los favoritos del usuario (una consulta si no está en caché)."""
+    cache = get_cache()
+    cached = cache.get(favorites_key(user_id))
+    if cached is not None:
+        return {product_id: favorite_id for product_id, favorite_id in cached}
+    rows = db.session.query(Favorites.product_id, Favorites.id).filter(Favorites.user_id == user_id).all()
+    cache.set(favorites_key(user_id), [[product_id, favorite_id] for product_id, favorite_id in rows],
+              ttl=FAVORITES_CACHE_TTL)
+    return dict(rows)
+
+
+def invalidate_favorites(user_id):
+    get_cache().delete(favorites_key(user_id))
+
+
+def insert_favorite(user_id, product_id, created_at=None):
+    """Añade el favorito si no existe, de forma atómica. Devuelve (favorite_id, creado)."""
+    values = {'user_id': user_id, 'product_id': product_id}
+    if created_at is not None:
+        values['created_at'] = created_at
+    insert = UPSERT_INSERTS.get(dialect_name())
+    if insert is not None:
+        statement = insert(Favorites).values(**values)\
+            .on_conflict_do_nothing(index_elements=['user_id', 'product_id']).returning(Favorites.id)
+        favorite_id = db.session.execute(statement).scalar()
+        if favorite_id is not None:
+            return favorite_id, True
+    else:
+        try:
+            with db.session.begin_nested():
+                favorite = Favorites(**values)
+                db.session.add(favorite)
+            return favorite.id, True
+        except IntegrityError:
+            pass
+    return db.session.query(Favorites.id).filter_by(user_id=user_id, product_id=product_id).scalar(), False
+
+
+def trending_exponent(moment):
+    """Peso de un favorito de `moment` en espacio logarítmico; siempre > 0, así que 0 significa sin favoritos."""
+    return ((moment or LEGACY_FAVORITE_DATE) - TRENDING_EPOCH).total_seconds() / TRENDING_TAU
+
+
+def trending_score(moments):
+    """Puntuación exacta a partir de las fechas de todos los favoritos; 0 si no hay ninguno."""
+    exponents = [trending_exponent(moment) for moment in moments]
+    if not exponents:
+        return 0.0
+    top = max(exponents)
+    return top + math.log(sum(math.exp(exponent - top) for exponent in exponents))
+
+
+def record_favorite_change(product_id, moment, delta):
+    """Aplica un alta (delta=1) o baja (delta=-1) a los contadores del producto, en la transacción actual.
+    El UPDATE del contador bloquea la fila, así que el recálculo de la puntuación no se pisa con otro."""
+    # updated_at se deja igual: los contadores no son parte del contenido del producto
+    Products.query.filter(Products.id == product_id).update(
+        {Products.favorite_count: Products.favorite_count + delta, Products.updated_at: Products.updated_at},
+        synchronize_session=False)
+    count, score = db.session.query(Products.favorite_count, Products.trending_score)\
+        .filter(Products.id == product_id).one()
+    exponent = trending_exponent(moment)
+    if count <= 0:
+        score = 0.0
+    elif delta > 0:
+        score = exponent if not score else max(score, exponent) + math.log1p(math.exp(-abs(score - exponent)))
+    elif score - exponent > 1e-9:
+        score = score + math.log1p(-math.exp(exponent - score))
+    else:
+        # Cancelación numérica (se quita el favorito que dominaba la suma): se recalcula exacto
+        score = trending_score(moment for (moment,) in db.session.query(Favorites.created_at)
+                               .filter(Favorites.product_id == product_id))
+    Products.query.filter(Products.id == product_id).update(
+        {Products.trending_score: score, Products.updated_at: Products.updated_at}, synchronize_session=False)
@@ -0,0 +1,89 @@
+"""
+Utilidades geográficas para filtrar productos por cercanía. Cada producto guarda latitude/longitude y
+su geohash; una zona se cubre con unas pocas celdas geohash que se consultan como rangos sobre el
+índice B-tree de `products.geohash`, igual en PostgreSQL y en SQLite.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+MAX_COVER_CELLS = 16
+KM_PER_DEGREE = 111.32
+EARTH_RADIUS_KM = 6371.0
+MAX_RADIUS_KM = 500
+
+
+def parse_coordinates(latitude, longitude):
+    """Convierte y valida un par lat/lng; lanza ValueError si no es válido."""
+    latitude, longitude = float(latitude), float(longitude)
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError((latitude, longitude))
+    return latitude, longitude
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    result, char, bits, even = [], 0, 0, True
+    while len(result) < precision:
+        interval, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (interval[0] + interval[1]) / 2
+        if value >= mid:
+            char, interval[0] = char * 2 + 1, mid
+        else:
+            char, interval[1] = char * 2, mid
+        even, bits = not even, bits + 1
+        if bits == 5:
+            result.append(BASE32[char])
+            char, bits = 0, 0
+    return ''.join(result)
+
+
+def cell_size(precision):
+    """(alto, ancho) en grados de una celda geohash de `precision` caracteres."""
+    lat_bits = 5 * precision // 2
+    lng_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def _samples(start, end, step):
+    return [start + i * step for i in range(int((end - start) / step) + 1)] + [end]
+
+
+def covering_cells(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_COVER_CELLS):
+    """Celdas geohash (con la mayor precisión posible sin pasar de `max_cells`) que cubren el rectángulo."""
+    precision = GEOHASH_PRECISION
+    while precision > 1:
+        height, width = cell_size(precision)
+        if (int((max_lat - min_lat) / height) + 2) * (int((max_lng - min_lng) / width) + 2) <= max_cells:
+            break
+        precision -= 1
+    height, width = cell_size(precision)
+    return sorted({encode_geohash(latitude, longitude, precision)
+                   for latitude in _samples(min_lat, max_lat, height)
+                   for longitude in _samples(min_lng, max_lng, width)})
+
+
+def prefix_upper_bound(cell):
+    """Menor cadena mayor que todos los geohash que empiezan por `cell` (None si no hay)."""
+    chars = list(cell)
+    for i in range(len(chars) - 1, -1, -1):
+        position = BASE32.index(chars[i])
+        if position < len(BASE32) - 1:
+            return ''.join(chars[:i]) + BASE32[position + 1]
+    return None
+
+
+def radius_bbox(latitude, longitude, radius_km):
+    """Rectángulo (min_lat, min_lng, max_lat, max_lng) que contiene el círculo de `radius_km`."""
+    delta_lat = radius_km / KM_PER_DEGREE
+    delta_lng = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return (max(latitude - delta_lat, -90.0), max(longitude - delta_lng, -180.0),
+            min(latitude + delta_lat, 90.0), min(longitude + delta_lng, 180.0))
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Distancia haversine en km."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
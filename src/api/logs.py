@@ -0,0 +1,105 @@
+"""
+Logging estructurado de la API. Los registros se encolan sin bloquear (cola acotada; si se llena se
+descartan) y un hilo QueueListener los escribe en stdout, en JSON o texto. Cada petición lleva un
+request id (cabecera X-Request-ID) y los niveles por debajo de WARNING se pueden muestrear.
+
+Variables: LOG_LEVEL (INFO), LOG_FORMAT (json|text), LOG_SAMPLE_RATE (1.0), LOG_QUEUE_SIZE (10000).
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from flask import g, has_request_context, request
+
+STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar todo lo que sea WARNING o superior y una fracción `rate` del resto."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloquea la petición: si la cola está llena, descarta el registro."""
+
+    dropped = 0
+
+    def prepare(self, record):
+        # La cola es en memoria: se conserva exc_info para que el formateador lo emita como campo propio
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None)
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in STANDARD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def setup_logging(app):
+    level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    if os.getenv('LOG_FORMAT', 'json') == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(formatter)
+    listener = logging.handlers.QueueListener(
+        queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', 10000))), output, respect_handler_level=False)
+
+    handler = DroppingQueueHandler(listener.queue)
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(SamplingFilter(float(os.getenv('LOG_SAMPLE_RATE', 1.0))))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+    @app.after_request
+    def expose_request_id(response):
+        if g.get('request_id'):
+            response.headers['X-Request-ID'] = g.request_id
+        return response
@@ -0,0 +1,110 @@
+"""
+Envío de correo en segundo plano a partir de la tabla email_outbox. Las rutas llaman a `enqueue_email`
+(dentro de su transacción) y, tras el commit, a `notify_mailer`, que despierta el worker. El worker
+reserva lotes de filas (FOR UPDATE SKIP LOCKED en PostgreSQL, para poder tener varios workers o
+procesos), los envía por una única conexión SMTP y reprograma los fallos con backoff exponencial.
+
+Variables: EMAIL_WORKER_THREADS (1; 0 desactiva el worker en proceso y hay que usar `flask send-emails`),
+EMAIL_BATCH_SIZE (20), EMAIL_MAX_ATTEMPTS (5), EMAIL_POLL_INTERVAL (10 s).
+"""
+import logging
+import os
+import smtplib
+from datetime import datetime, timedelta
+from flask import current_app
+from flask_mail import Message
+from api.models import db, EmailOutbox
+from api.workers import PollingWorker, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+LEASE_SECONDS = 300  # una fila en 'sending' más tiempo que esto se considera abandonada y se reintenta
+
+
+def enqueue_email(recipient, subject, body):
+    """Añade un correo al outbox; se envía cuando la transacción en curso haga commit."""
+    email = EmailOutbox(recipient=recipient, subject=subject, body=body)
+    db.session.add(email)
+    return email
+
+
+def notify_mailer():
+    worker = current_app.extensions.get('mailer')
+    if worker is not None:
+        worker.wake()
+
+
+def claim_batch(limit):
+    """Reserva hasta `limit` correos listos y hace commit para no mantener bloqueos durante el envío SMTP."""
+    now = datetime.utcnow()
+    emails = EmailOutbox.query.filter(
+        EmailOutbox.status.in_(['pending', 'sending']),
+        EmailOutbox.next_attempt_at <= now
+    ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)\
+        .with_for_update(skip_locked=True).limit(limit).all()
+    for email in emails:
+        email.status = 'sending'
+        email.attempts += 1
+        email.next_attempt_at = now + timedelta(seconds=LEASE_SECONDS)
+    db.session.commit()
+    return emails
+
+
+def record_failure(email, error, max_attempts):
+    email.last_error = str(error)[:1000]
+    if email.attempts >= max_attempts:
+        email.status = 'failed'
+        logger.error("Correo descartado tras agotar los reintentos",
+                     extra={"email_id": email.id, "attempts": email.attempts})
+    else:
+        email.status = 'pending'
+        email.next_attempt_at = datetime.utcnow() + backoff_delay(email.attempts, BACKOFF_BASE_SECONDS, BACKOFF_MAX_SECONDS)
+        logger.warning("Fallo al enviar correo, se reintentará",
+                       extra={"email_id": email.id, "attempts": email.attempts, "error": email.last_error})
+
+
+def send_pending(app, batch_size=None, max_attempts=None):
+    """Envía un lote del outbox reutilizando una conexión SMTP. Devuelve el número de correos procesados."""
+    batch_size = batch_size or int(os.getenv('EMAIL_BATCH_SIZE', BATCH_SIZE))
+    max_attempts = max_attempts or int(os.getenv('EMAIL_MAX_ATTEMPTS', MAX_ATTEMPTS))
+    emails = claim_batch(batch_size)
+    if not emails:
+        return 0
+
+    pending = list(emails)
+    try:
+        with app.extensions['mail'].connect() as connection:
+            while pending:
+                email = pending[0]
+                try:
+                    connection.send(Message(subject=email.subject, recipients=[email.recipient], body=email.body))
+                    email.status = 'sent'
+                    email.sent_at = datetime.utcnow()
+                    email.last_error = None
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as error:
+                    # Error propio de este correo: la conexión sigue siendo válida para el resto
+                    record_failure(email, error, max_attempts)
+                pending.pop(0)
+    except Exception as error:
+        # Conexión caída o servidor no disponible: se reprograma lo que quedaba por enviar
+        for email in pending:
+            record_failure(email, error, max_attempts)
+    db.session.commit()
+    return len(emails)
+
+
+def setup_mailer(app):
+    threads = int(os.getenv('EMAIL_WORKER_THREADS', 1))
+    if threads > 0:
+        app.extensions['mailer'] = PollingWorker(app, 'mailer', send_pending,
+                                                 interval=float(os.getenv('EMAIL_POLL_INTERVAL', 10)),
+                                                 threads=threads)
+
+        @app.before_request
+        def start_mailer():
+            # Arranca con la primera petición para recoger también lo que quedara pendiente de antes
+            app.extensions['mailer'].start()
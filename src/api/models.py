@@ -1,8 +1,12 @@
+import logging
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import JSON
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from datetime import datetime, timezone
+from api.geo import encode_geohash
 
 db = SQLAlchemy()
+logger = logging.getLogger(__name__)
 
 
 class Users(db.Model):
@@ -14,6 +18,13 @@ class Users(db.Model):
     password = db.Column(db.String(), nullable=False)
     role = db.Column(db.Enum('vendedor', 'comprador', 'administrador', name='role'), nullable=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    # Versión de fila (se incrementa en cada UPDATE) y fecha de modificación, usadas para los ETag
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Mensajes recibidos sin leer; se mantiene con UPDATE atómicos al crear y leer mensajes
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __mapper_args__ = {'version_id_col': version}
     
     def __repr__(self):
         return f'<User {self.id} - {self.email}>'
@@ -43,6 +54,10 @@ class Comments(db.Model):
     profile_user = db.relationship('Users', foreign_keys=[profile_user_id],
                                  backref=db.backref('profile_comments', lazy='select'))
 
+    __table_args__ = (
+        db.Index('ix_comments_profile_user_id_created_at', 'profile_user_id', 'created_at'),
+    )
+
     def __repr__(self):
         return f'<Comments {self.id}>'
 
@@ -60,14 +75,22 @@ class Comments(db.Model):
 class Orders(db.Model):
     __tablename__= 'orders'
     id= db.Column(db.Integer, primary_key=True)
-    status = db.Column(db.Enum('pending', 'close', 'paid', 'canceled', name='status'), nullable=False)
-    created_at = db.Column(db.Date, nullable=False)
+    # refund_needed: el pago llegó pero el pedido ya no se podía completar (cancelado o productos vendidos)
+    status = db.Column(db.Enum('pending', 'close', 'paid', 'canceled', 'refund_needed', name='status'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     total = db.Column(db.Float, nullable=False)
-    paid_at = db.Column(db.Date, nullable=False)
+    paid_at = db.Column(db.DateTime, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # PaymentIntent de Stripe que paga el pedido (lo fija el procesado del webhook)
+    payment_intent_id = db.Column(db.String(255), nullable=True)
     user_to = db.relationship('Users', foreign_keys=[user_id],
                            backref=db.backref('orders', lazy='select'))
-    
+
+    __table_args__ = (
+        db.Index('uq_orders_payment_intent_id', 'payment_intent_id', unique=True),
+        db.Index('ix_orders_user_id_created_at', 'user_id', 'created_at'),
+    )
+
     def __repr__(self):
         return f'<Order {self.id} - user {self.user_id} - status {self.status}>'
 
@@ -75,9 +98,9 @@ class Orders(db.Model):
         return {"id": self.id,
              "user_id": self.user_id,
              "status": self.status,
-             "created_at": self.created_at,
+             "created_at": self.created_at.isoformat() if self.created_at else None,
              "total": self.total,
-             "paid_at": self.paid_at}
+             "paid_at": self.paid_at.isoformat() if self.paid_at else None}
 
 
 class OrderItems(db.Model):
@@ -109,14 +132,27 @@ class Messages(db.Model):
     content = db.Column(db.Text, nullable=False)
     user_sender = db.Column(db.Integer, db.ForeignKey('users.id'))
     user_receiver = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # Identifica la conversación entre dos usuarios independientemente del sentido: "<menor id>:<mayor id>"
+    conversation_key = db.Column(db.String(40), nullable=True)
     user_sender_to = db.relationship('Users', foreign_keys=[user_sender],
                            backref=db.backref('message_sent', lazy='select'))
     user_receiver_to = db.relationship('Users', foreign_keys=[user_receiver],
                               backref=db.backref('message_received', lazy='select'))
 
+    __table_args__ = (
+        db.Index('ix_messages_user_receiver_created_at', 'user_receiver', 'created_at'),
+        db.Index('ix_messages_user_sender_created_at', 'user_sender', 'created_at'),
+        db.Index('ix_messages_conversation_key_created_at_id', 'conversation_key', 'created_at', 'id'),
+    )
+
     def __repr__(self):
         return f'<Messages {self.id} - from {self.user_sender} to {self.user_receiver}>'
 
+    @staticmethod
+    def conversation_key_for(user_a, user_b):
+        low, high = sorted([int(user_a), int(user_b)])
+        return f"{low}:{high}"
+
     def serialize(self):
         try:
             return {
@@ -127,8 +163,8 @@ class Messages(db.Model):
                 "created_at": self.created_at.isoformat() if self.created_at else None,
                 "review_date": self.review_date.isoformat() if self.review_date else None
             }
-        except Exception as e:
-            print(f"💥 Error serializando mensaje {self.id}: {str(e)}")
+        except Exception:
+            logger.exception("Error serializando mensaje", extra={"message_id": self.id})
             return {
                 "id": self.id,
                 "user_sender": self.user_sender,
@@ -145,11 +181,17 @@ class Favorites(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'))
+    # Los favoritos anteriores a la columna tienen la fecha fija 2025-01-01 (ver api.favorites)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=True)
     user_to = db.relationship('Users', foreign_keys=[user_id],
                            backref=db.backref('favorites', lazy='select'))
     product_to = db.relationship('Products', foreign_keys=[product_id],
                               backref=db.backref('favorited_by', lazy='select'))
 
+    __table_args__ = (
+        db.Index('uq_favorites_user_id_product_id', 'user_id', 'product_id', unique=True),
+    )
+
     def serialize(self):
         return {"id": self.id,
                 "user_id": self.user_id,
@@ -164,8 +206,11 @@ class Products(db.Model):
     price = db.Column(db.Float, nullable=False)
     available = db.Column(db.Boolean, default=True, nullable=False)
     location = db.Column(db.String(120))
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)
     image_urls = db.Column(JSON, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     tags = db.Column(db.Enum('new', 'used', 'acceptable', name='tags'), nullable=False)
     category = db.Column(
         db.Enum(
@@ -183,13 +228,40 @@ class Products(db.Model):
         nullable=False
     )
     was_sold = db.Column(db.Boolean, default=False)
+    # Pedido pendiente que tiene el producto reservado (ver api.orders); sin FK para no bloquear su borrado
+    reserved_order_id = db.Column(db.Integer, nullable=True)
+    # Contadores de popularidad mantenidos con UPDATE incrementales (ver api.favorites); no cambian la versión
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    trending_score = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     user_to = db.relationship('Users', foreign_keys=[user_id],
                            backref=db.backref('on_sale', lazy='select'))
+    # Documento de búsqueda (title, category, description); lo mantiene un trigger en PostgreSQL
+    search_vector = db.deferred(db.Column(db.Text().with_variant(TSVECTOR(), 'postgresql'), nullable=True))
+
+    __mapper_args__ = {'version_id_col': version}
+
+    __table_args__ = (
+        db.Index('ix_products_available_created_at_id', 'available', 'created_at', 'id'),
+        db.Index('ix_products_available_price_id', 'available', 'price', 'id'),
+        db.Index('ix_products_available_category_price', 'available', 'category', 'price', 'id'),
+        db.Index('ix_products_available_favorite_count_id', 'available', 'favorite_count', 'id'),
+        db.Index('ix_products_available_trending_score_id', 'available', 'trending_score', 'id'),
+        db.Index('ix_products_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_products_title_trgm', 'title', postgresql_using='gin',
+                 postgresql_ops={'title': 'gin_trgm_ops'}),
+    )
     
     def __repr__(self):
         return f'<Product {self.id} - {self.title}>'
 
+    def set_coordinates(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.geohash = encode_geohash(latitude, longitude) if latitude is not None else None
+
     def serialize(self):
         return {'id': self.id,
             'user_id': self.user_id,
@@ -198,9 +270,141 @@ class Products(db.Model):
             'price': self.price,
             'available': self.available,
             'location': self.location,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
             'image_urls': self.image_urls or [],
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'tags': self.tags,
             'category': self.category,
             'was_sold': self.was_sold}
-    
\ No newline at end of file
+    
+
+class ProductCards(db.Model):
+    """
+    Modelo de lectura desnormalizado para los listados: solo los campos de la tarjeta de producto,
+    el nombre del vendedor y el número de favoritos. Se refresca en la misma transacción que las
+    escrituras de productos, vendedores y favoritos.
+    """
+    __tablename__ = 'product_cards'
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    id = db.synonym('product_id')
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    title = db.Column(db.String(120), nullable=False)
+    excerpt = db.Column(db.String(160), nullable=True)
+    price = db.Column(db.Float, nullable=False)
+    location = db.Column(db.String(120))
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    thumbnail_url = db.Column(db.String(), nullable=True)
+    tags = db.Column(db.String(20), nullable=False)
+    category = db.Column(db.String(60), nullable=False)
+    available = db.Column(db.Boolean, nullable=False)
+    was_sold = db.Column(db.Boolean, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    seller_name = db.Column(db.String(241), nullable=True)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_product_cards_user_id_created_at', 'user_id', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f'<ProductCard {self.product_id} - {self.title}>'
+
+    @classmethod
+    def refresh(cls, product):
+        """Crea o actualiza la tarjeta de `product` (llamar tras flush y antes del commit)."""
+        card = db.session.get(cls, product.id) or cls(product_id=product.id)
+        seller = db.session.get(Users, product.user_id)
+        card.user_id = product.user_id
+        card.title = product.title
+        card.excerpt = (product.description or '')[:160]
+        card.price = product.price
+        card.location = product.location
+        card.latitude = product.latitude
+        card.longitude = product.longitude
+        card.thumbnail_url = (product.image_urls or [None])[0]
+        card.tags = product.tags
+        card.category = product.category
+        card.available = product.available
+        card.was_sold = product.was_sold
+        card.created_at = product.created_at or datetime.utcnow()
+        card.seller_name = f"{seller.first_name} {seller.last_name}" if seller else None
+        card.favorite_count = product.favorite_count or 0
+        db.session.add(card)
+        return card
+
+    @classmethod
+    def refresh_favorite_count(cls, product_id):
+        """Copia el contador de products (sin contar filas de favorites)."""
+        count = db.session.query(Products.favorite_count).filter(Products.id == product_id).scalar_subquery()
+        cls.query.filter_by(product_id=product_id).update({'favorite_count': count}, synchronize_session=False)
+
+    @classmethod
+    def refresh_seller(cls, user):
+        cls.query.filter_by(user_id=user.id).update({'seller_name': f"{user.first_name} {user.last_name}"})
+
+    def serialize(self):
+        return {'id': self.product_id,
+            'user_id': self.user_id,
+            'title': self.title,
+            'description': self.excerpt,
+            'price': self.price,
+            'available': self.available,
+            'location': self.location,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'image_urls': [self.thumbnail_url] if self.thumbnail_url else [],
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'tags': self.tags,
+            'category': self.category,
+            'was_sold': self.was_sold,
+            'seller_name': self.seller_name,
+            'favorite_count': self.favorite_count}
+
+
+class EmailOutbox(db.Model):
+    """Correos pendientes de envío. Las rutas solo insertan filas; api.mailer las envía en segundo plano."""
+    __tablename__ = 'email_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    # pending -> sending -> sent | failed (tras agotar los reintentos)
+    status = db.Column(db.String(20), nullable=False, default='pending', server_default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_error = db.Column(db.Text, nullable=True)
+    # Próximo intento (backoff) o fin de la reserva de una fila en 'sending'
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.id} - {self.recipient} ({self.status})>'
+
+
+class StripeEvents(db.Model):
+    """Inbox de eventos de webhook de Stripe. La clave es el id del evento, así que las entregas
+    repetidas no se duplican; api.webhooks los procesa en segundo plano."""
+    __tablename__ = 'stripe_events'
+    id = db.Column(db.String(255), primary_key=True)
+    type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(JSON, nullable=False)
+    # pending -> processing -> processed | ignored | failed (tras agotar los reintentos)
+    status = db.Column(db.String(20), nullable=False, default='pending', server_default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_stripe_events_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<StripeEvent {self.id} - {self.type} ({self.status})>'
@@ -0,0 +1,100 @@
+"""
+Creación de pedidos. `place_order` carga todos los productos pedidos en una sola consulta IN con
+SELECT ... FOR UPDATE SKIP LOCKED (un producto bloqueado por otra compra en curso cuenta como no
+disponible en lugar de esperar), calcula el total en el servidor y reserva los productos
+(available=False, reserved_order_id=pedido) en la misma transacción. La reserva se libera una sola vez,
+cuando un pedido pendiente se cancela o se borra, y solo sobre los productos que siguen reservados por él.
+"""
+from datetime import datetime
+from sqlalchemy import and_, or_
+from api.models import db, Products, ProductCards, Orders, OrderItems
+from api.cache import invalidate_product
+from api.search import unindex_product
+from api.utils import APIException
+
+MAX_ORDER_ITEMS = 50
+
+
+def reservable(product, user_id):
+    return product.available and not product.was_sold and product.user_id != user_id
+
+
+def parse_product_id(value):
+    """Id de producto entero positivo (también como texto: "3"). Lanza APIException 400 si no lo es."""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise APIException(f"product_id inválido: {value!r}.")
+    try:
+        product_id = int(value)
+    except (TypeError, ValueError):
+        raise APIException(f"product_id inválido: {value!r}.")
+    if product_id <= 0:
+        raise APIException(f"product_id inválido: {value!r}.")
+    return product_id
+
+
+def place_order(user_id, product_ids):
+    """Crea un pedido pendiente con `product_ids` y los reserva. Lanza APIException (400/409) si algún
+    id no es válido, algún producto no existe, no está disponible o es del propio comprador."""
+    product_ids = list(dict.fromkeys(parse_product_id(product_id) for product_id in product_ids))
+    if not product_ids:
+        raise APIException("El pedido no contiene productos.")
+    if len(product_ids) > MAX_ORDER_ITEMS:
+        raise APIException(f"Un pedido admite como máximo {MAX_ORDER_ITEMS} productos.")
+
+    products = Products.query.filter(Products.id.in_(product_ids))\
+        .order_by(Products.id).with_for_update(skip_locked=True).all()
+    unavailable = set(product_ids) - {product.id for product in products if reservable(product, user_id)}
+    if unavailable:
+        db.session.rollback()
+        raise APIException("Algunos productos ya no están disponibles.", status_code=409,
+                           payload={"unavailable": sorted(unavailable)})
+
+    now = datetime.utcnow()
+    order = Orders(user_id=user_id, status='pending', created_at=now,
+                   total=round(sum(product.price for product in products), 2))
+    db.session.add(order)
+    db.session.flush()
+
+    # Reserva condicional: en SQLite (sin FOR UPDATE) es la que impide vender dos veces el mismo producto
+    reserved = Products.query.filter(Products.id.in_(product_ids), Products.available.is_(True),
+                                     or_(Products.was_sold.is_(False), Products.was_sold.is_(None)))\
+        .update({Products.available: False,
+                 Products.reserved_order_id: order.id,
+                 Products.version: Products.version + 1,
+                 Products.updated_at: now}, synchronize_session=False)
+    if reserved != len(product_ids):
+        db.session.rollback()
+        raise APIException("Algunos productos ya no están disponibles.", status_code=409)
+
+    db.session.add_all([OrderItems(order_id=order.id, product_id=product.id, total=product.price)
+                        for product in products])
+    for product in products:
+        db.session.expire(product)
+        ProductCards.refresh(product)
+    db.session.commit()
+
+    for product in products:
+        invalidate_product(product.id, product.user_id)
+        unindex_product(product.id)
+    return order
+
+
+def release_order(order):
+    """Devuelve al catálogo los productos que siguen reservados por `order` si está pendiente (llamar antes
+    del commit que lo cancela o lo borra). Devuelve los (product_id, user_id) afectados para invalidar la
+    caché y reindexar tras el commit."""
+    if order.status != 'pending':
+        return []
+    condition = and_(Products.reserved_order_id == order.id, Products.available.is_(False),
+                     or_(Products.was_sold.is_(False), Products.was_sold.is_(None)))
+    products = Products.query.filter(condition).all()
+    if not products:
+        return []
+    Products.query.filter(condition).update({Products.available: True,
+                                             Products.reserved_order_id: None,
+                                             Products.version: Products.version + 1,
+                                             Products.updated_at: datetime.utcnow()}, synchronize_session=False)
+    for product in products:
+        db.session.expire(product)
+        ProductCards.refresh(product)
+    return [(product.id, product.user_id) for product in products]
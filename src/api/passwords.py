@@ -0,0 +1,126 @@
+"""
+Hash de contraseñas con algoritmo y coste configurables (PASSWORD_HASH_METHOD):
+
+- "scrypt:32768:8:1" (n:r:p) o "pbkdf2:sha256:600000" (iteraciones): formatos de werkzeug.
+- "argon2" o "argon2:<time_cost>:<memory_kib>:<parallelism>": requiere el paquete opcional argon2-cffi.
+
+Los hashes guardan sus parámetros, así que se pueden verificar hashes antiguos con cualquier
+configuración; `needs_rehash` indica si hay que regenerarlo (se hace al hacer login). El cálculo se
+ejecuta en un pool de hilos acotado (PASSWORD_HASH_WORKERS, por defecto un hilo por núcleo): como mucho
+ese número de hashes a la vez por proceso, y si hay más de PASSWORD_HASH_QUEUE esperando se rechaza con
+PasswordServiceBusy en lugar de acumular peticiones.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, jsonify
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+ARGON2_DEFAULTS = (3, 65536, 4)  # time_cost, memory_cost (KiB), parallelism (valores de argon2-cffi)
+QUEUE_WAIT_SECONDS = 5
+
+
+class PasswordServiceBusy(Exception):
+    """Demasiados hashes pendientes; `retry_after` en segundos."""
+
+    def __init__(self, retry_after=1):
+        super().__init__("Servidor ocupado, inténtalo de nuevo en unos segundos.")
+        self.retry_after = retry_after
+
+
+def argon2_hasher(method):
+    try:
+        from argon2 import PasswordHasher
+    except ImportError:
+        raise RuntimeError("PASSWORD_HASH_METHOD=argon2 requiere instalar el paquete 'argon2-cffi' (pipenv install argon2-cffi).")
+    params = [int(value) for value in method.split(':')[1:]] or list(ARGON2_DEFAULTS)
+    time_cost, memory_cost, parallelism = params
+    return PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, workers=None, max_pending=None):
+        self.method = method
+        self._argon2 = argon2_hasher(method) if method.startswith('argon2') else None
+        # Prefijo de los hashes generados con la configuración actual (p.ej. "pbkdf2:sha256:1000000"),
+        # con los valores por defecto de werkzeug ya resueltos
+        self._prefix = None if self._argon2 else generate_password_hash('-', method=method).split('$', 1)[0]
+        workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='passwords')
+        self._slots = threading.BoundedSemaphore(workers + (max_pending if max_pending is not None else workers * 4))
+        self._dummy_hash = self._hash('-')
+
+    def _hash(self, password):
+        if self._argon2 is not None:
+            return self._argon2.hash(password)
+        return generate_password_hash(password, method=self.method)
+
+    def _verify(self, stored, password):
+        if stored and stored.startswith('$argon2'):
+            hasher = self._argon2 or argon2_hasher('argon2')
+            try:
+                return hasher.verify(stored, password)
+            except Exception:
+                return False
+        return check_password_hash(stored or '', password)
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(timeout=QUEUE_WAIT_SECONDS):
+            raise PasswordServiceBusy()
+        try:
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(self._hash, password)
+
+    def verify(self, stored, password):
+        """Comprueba la contraseña. Con stored=None se compara con un hash ficticio para que un usuario
+        inexistente tarde lo mismo que una contraseña incorrecta."""
+        if stored is None:
+            self._run(self._verify, self._dummy_hash, password)
+            return False
+        return self._run(self._verify, stored, password)
+
+    def needs_rehash(self, stored):
+        if self._argon2 is not None:
+            if not stored.startswith('$argon2'):
+                return True
+            return self._argon2.check_needs_rehash(stored)
+        return stored.split('$', 1)[0] != self._prefix
+
+
+def setup_passwords(app, hasher=None):
+    if hasher is None:
+        max_pending = os.getenv('PASSWORD_HASH_QUEUE')
+        hasher = PasswordHasher(method=os.getenv('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+                                workers=int(os.getenv('PASSWORD_HASH_WORKERS', 0)) or None,
+                                max_pending=int(max_pending) if max_pending else None)
+    app.extensions['passwords'] = hasher
+
+    @app.errorhandler(PasswordServiceBusy)
+    def handle_password_service_busy(error):
+        response = jsonify({"msg": str(error)})
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 503
+
+
+def get_hasher():
+    return current_app.extensions['passwords']
+
+
+def hash_password(password):
+    return get_hasher().hash(password)
+
+
+def verify_password(stored, password):
+    return get_hasher().verify(stored, password)
+
+
+def needs_rehash(stored):
+    return get_hasher().needs_rehash(stored)
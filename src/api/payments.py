@@ -0,0 +1,169 @@
+"""
+Pasarela de pagos sobre Stripe. Un único StripeClient por proceso con un RequestsClient (sesión HTTP
+con conexiones reutilizadas), timeouts estrictos y reintentos de red acotados; un circuit breaker que
+deja de llamar a Stripe durante un tiempo cuando falla seguido, y claves de idempotencia derivadas de
+(usuario, producto o pedido, importe) para que los reintentos del cliente no creen intents duplicados. Cuando
+un intent se cancela, el siguiente intento usa una clave nueva (derivada del intent cancelado). Los intents
+creados se guardan en memoria mientras siguen siendo válidos.
+
+Variables: STRIPE_SECRET_KEY, STRIPE_WEBHOOK_SECRET, STRIPE_API_BASE (p.ej. http://localhost:12111 con stripe-mock),
+STRIPE_CONNECT_TIMEOUT (3 s), STRIPE_READ_TIMEOUT (10 s), STRIPE_MAX_RETRIES (2).
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import stripe
+from flask import current_app
+from api.cache import LocalCache
+
+logger = logging.getLogger(__name__)
+
+CURRENCY = 'eur'
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+INTENT_CACHE_TTL = 3600  # las claves de idempotencia de Stripe duran 24 h; el intent se reutiliza 1 h
+INTENT_CACHE_MAX_ENTRIES = 10000
+IDEMPOTENCY_KEY_TTL = 86400
+MAX_CANCELED_ATTEMPTS = 5
+
+# Errores que indican que Stripe no está disponible (cuentan para el circuit breaker)
+UNAVAILABLE_ERRORS = (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError)
+
+
+class PaymentUnavailable(Exception):
+    """Stripe no responde o el circuito está abierto; `retry_after` en segundos."""
+
+    def __init__(self, message, retry_after=RESET_TIMEOUT):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Abre el circuito tras `failure_threshold` fallos seguidos; pasado `reset_timeout` deja pasar una
+    llamada de prueba (semiabierto) y se cierra si tiene éxito."""
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise PaymentUnavailable("Servicio de pagos no disponible temporalmente.",
+                                         retry_after=max(int(remaining) + 1, 1))
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("Circuito de Stripe abierto", extra={"failures": self.failures})
+                self.opened_at = time.monotonic()
+
+
+class PaymentGateway:
+    def __init__(self, api_key, api_base=None, timeout=(3, 10), max_retries=2, breaker=None, webhook_secret=None):
+        self.client = stripe.StripeClient(
+            api_key,
+            http_client=stripe.RequestsClient(timeout=timeout),
+            max_network_retries=max_retries,
+            base_addresses={'api': api_base} if api_base else None
+        )
+        self.breaker = breaker or CircuitBreaker()
+        self.webhook_secret = webhook_secret
+        self.intents = LocalCache(max_entries=INTENT_CACHE_MAX_ENTRIES, default_ttl=INTENT_CACHE_TTL)
+        # Clave base -> clave de idempotencia del intento en curso (cambia cuando se cancela un intent)
+        self.attempts = LocalCache(max_entries=INTENT_CACHE_MAX_ENTRIES, default_ttl=IDEMPOTENCY_KEY_TTL)
+
+    @staticmethod
+    def idempotency_key(user_id, amount, reference):
+        target = ':'.join(f"{name}={value}" for name, value in sorted(reference.items()))
+        raw = f"payment-intent:{user_id}:{target}:{amount}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _next_attempt(self, base_key, canceled_intent_id):
+        key = hashlib.sha256(f"{base_key}:after:{canceled_intent_id}".encode()).hexdigest()
+        self.attempts.set(base_key, key)
+        return key
+
+    def create_payment_intent(self, user_id, amount, **reference):
+        """Devuelve el client_secret del intent para el usuario, el importe en céntimos y lo que se paga
+        (`product_id=` o `order_id=`, que se guarda también en la metadata)."""
+        base_key = self.idempotency_key(user_id, amount, reference)
+        key = self.attempts.get(base_key) or base_key
+        client_secret = self.intents.get(key)
+        if client_secret is not None:
+            return client_secret
+
+        params = {'amount': amount, 'currency': CURRENCY, 'metadata': {**reference, 'user_id': user_id}}
+        intent = self._create_intent(params, key)
+        # Si la cancelación se procesó en otro proceso, Stripe devuelve el intent cancelado para esta clave
+        for _ in range(MAX_CANCELED_ATTEMPTS):
+            if intent.status != 'canceled':
+                break
+            key = self._next_attempt(base_key, intent.id)
+            intent = self._create_intent(params, key)
+        self.intents.set(key, intent.client_secret)
+        return intent.client_secret
+
+    def _create_intent(self, params, key):
+        self.breaker.before_call()
+        try:
+            intent = self.client.v1.payment_intents.create(params=params, options={'idempotency_key': key})
+        except UNAVAILABLE_ERRORS as error:
+            self.breaker.record_failure()
+            logger.warning("Stripe no disponible", extra={"error": str(error)})
+            raise PaymentUnavailable("Servicio de pagos no disponible temporalmente.")
+        except stripe.StripeError:
+            # Error de la petición (no de disponibilidad): Stripe ha respondido, el circuito sigue sano
+            self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return intent
+
+    def construct_event(self, payload, signature):
+        """Verifica la firma Stripe-Signature del webhook. Lanza ValueError o
+        stripe.SignatureVerificationError si el cuerpo no es válido o la firma no coincide."""
+        if not self.webhook_secret:
+            raise RuntimeError("STRIPE_WEBHOOK_SECRET no está configurado.")
+        return self.client.construct_event(payload, signature, self.webhook_secret)
+
+    def forget_intent(self, intent_id, user_id, amount, **reference):
+        """Olvida el intent `intent_id` (cancelado): el próximo pago del mismo usuario, importe y referencia
+        crea un intent nuevo con otra clave de idempotencia."""
+        base_key = self.idempotency_key(user_id, amount, reference)
+        self.intents.delete(self.attempts.get(base_key) or base_key)
+        self._next_attempt(base_key, intent_id)
+
+
+def setup_payments(app, gateway=None):
+    if gateway is None:
+        gateway = PaymentGateway(
+            os.getenv('STRIPE_SECRET_KEY') or '',
+            api_base=os.getenv('STRIPE_API_BASE'),
+            timeout=(float(os.getenv('STRIPE_CONNECT_TIMEOUT', 3)), float(os.getenv('STRIPE_READ_TIMEOUT', 10))),
+            max_retries=int(os.getenv('STRIPE_MAX_RETRIES', 2)),
+            webhook_secret=os.getenv('STRIPE_WEBHOOK_SECRET')
+        )
+    app.extensions['payments'] = gateway
+
+
+def get_gateway():
+    return current_app.extensions['payments']
@@ -0,0 +1,232 @@
+"""
+Limitación de peticiones con token buckets, pensada para los endpoints caros (login, recuperación de
+contraseña): cada regla tiene un cubo por clave (IP del cliente, email del cuerpo) con `capacity`
+fichas que se rellenan a ritmo constante. La comprobación se hace en el decorador, antes de tocar la
+base de datos o calcular hashes, y si no quedan fichas se contesta 429 con Retry-After.
+
+El cubo por email del login solo se cobra cuando las credenciales fallan (401): antes del intento se
+comprueba que quede alguna ficha y la ficha se descuenta después, así que los logins correctos no gastan el
+cupo. Además la clave es (email, red del cliente: /24 en IPv4, /64 en IPv6), de modo que quien conoce una
+dirección no puede dejar bloqueado a su dueño desde cualquier sitio rotando IPs: solo agota el cupo de sus
+propias redes. El precio es que un ataque repartido entre muchas redes consigue RATE_LIMIT_LOGIN_EMAIL
+intentos por red y cuenta; cada IP sigue limitada además por RATE_LIMIT_LOGIN_IP.
+
+El almacén por defecto es en memoria por proceso; con RATE_LIMIT_BACKEND=redis (y REDIS_URL) se comparte
+entre workers. Las reglas se configuran como "<capacidad>/<segundos>", p.ej. RATE_LIMIT_LOGIN_IP=20/60.
+Detrás de un proxy hay que fijar PROXY_FIX_X_FOR (número de proxies) para que la IP sea la del cliente.
+"""
+import ipaddress
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, jsonify, make_response, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+from api.cache import redis_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    'RATE_LIMIT_LOGIN_IP': '20/60',
+    'RATE_LIMIT_LOGIN_EMAIL': '5/300',
+    'RATE_LIMIT_FORGOT_IP': '5/300',
+    'RATE_LIMIT_FORGOT_EMAIL': '3/3600',
+    'RATE_LIMIT_REGISTER_IP': '10/3600',
+}
+
+# Script atómico para Redis: mismo algoritmo que LocalBucketStore.take
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local consume = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    if consume == 1 then
+        tokens = tokens - cost
+    end
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+
+class LocalBucketStore:
+    """Cubos en memoria (LRU acotado: un cubo expulsado vuelve a empezar lleno)."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1, consume=True):
+        """Consume `cost` fichas del cubo `key` (con consume=False solo comprueba que las haya). Devuelve
+        (permitido, segundos hasta poder reintentar)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                if consume:
+                    tokens -= cost
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+
+class RedisBucketStore:
+    def __init__(self, client, prefix='ratelimit:'):
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, capacity, rate, cost=1, consume=True):
+        allowed, retry_after = self._script(keys=[self.prefix + key],
+                                            args=[capacity, rate, time.time(), cost, int(consume)])
+        return bool(allowed), float(retry_after)
+
+
+class NullBucketStore:
+    def take(self, key, capacity, rate, cost=1, consume=True):
+        return True, 0.0
+
+
+def parse_limit_setting(setting):
+    capacity, seconds = setting.split('/')
+    return int(capacity), int(capacity) / float(seconds)
+
+
+def client_ip():
+    return request.remote_addr or 'unknown'
+
+
+def client_network():
+    try:
+        address = ipaddress.ip_address(client_ip())
+    except ValueError:
+        return client_ip()
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+
+def request_email():
+    data = request.get_json(silent=True) or {}
+    email = data.get('email') if isinstance(data, dict) else None
+    return str(email).strip().lower() if email else None
+
+
+def request_email_and_network():
+    email = request_email()
+    return f"{email}|{client_network()}" if email else None
+
+
+class RateLimit:
+    """Regla con nombre, función que da la clave de la petición (None = no aplica) y ajuste en la config.
+    Con `failures_only` la ficha solo se descuenta si la vista contesta con uno de FAILURE_STATUSES."""
+
+    def __init__(self, name, key_func, config_key, failures_only=False):
+        self.name = name
+        self.key_func = key_func
+        self.config_key = config_key
+        self.failures_only = failures_only
+
+
+FAILURE_STATUSES = (401,)
+
+LOGIN_LIMITS = (RateLimit('login-ip', client_ip, 'RATE_LIMIT_LOGIN_IP'),
+                RateLimit('login-email', request_email_and_network, 'RATE_LIMIT_LOGIN_EMAIL', failures_only=True))
+FORGOT_LIMITS = (RateLimit('forgot-ip', client_ip, 'RATE_LIMIT_FORGOT_IP'),
+                 RateLimit('forgot-email', request_email, 'RATE_LIMIT_FORGOT_EMAIL'))
+REGISTER_LIMITS = (RateLimit('register-ip', client_ip, 'RATE_LIMIT_REGISTER_IP'),)
+
+
+def check_limits(limits):
+    """Aplica las reglas en orden (la IP antes que el email); devuelve los segundos de espera o None.
+    Las reglas `failures_only` solo se comprueban aquí; las cobra charge_failures."""
+    store = current_app.extensions.get('rate_limits') or NullBucketStore()
+    for limit in limits:
+        key = limit.key_func()
+        if key is None:
+            continue
+        capacity, rate = parse_limit_setting(current_app.config[limit.config_key])
+        try:
+            allowed, retry_after = store.take(f"{limit.name}:{key}", capacity, rate,
+                                              consume=not limit.failures_only)
+        except Exception:
+            # Si el almacén compartido no responde no se bloquea el login
+            logger.warning("Almacén de rate limit no disponible", exc_info=True)
+            return None
+        if not allowed:
+            logger.info("Petición limitada", extra={"limit": limit.name})
+            return retry_after
+    return None
+
+
+def charge_failures(limits):
+    """Descuenta una ficha de cada regla `failures_only` tras un intento fallido."""
+    store = current_app.extensions.get('rate_limits') or NullBucketStore()
+    for limit in limits:
+        key = limit.key_func() if limit.failures_only else None
+        if key is None:
+            continue
+        capacity, rate = parse_limit_setting(current_app.config[limit.config_key])
+        try:
+            store.take(f"{limit.name}:{key}", capacity, rate)
+        except Exception:
+            logger.warning("Almacén de rate limit no disponible", exc_info=True)
+            return
+
+
+def rate_limit(*limits):
+    charges_failures = any(limit.failures_only for limit in limits)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            retry_after = check_limits(limits)
+            if retry_after is not None:
+                response = jsonify({"msg": "Demasiados intentos. Inténtalo de nuevo más tarde."})
+                response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+                return response, 429
+            if not charges_failures:
+                return view(*args, **kwargs)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code in FAILURE_STATUSES:
+                charge_failures(limits)
+            return response
+        return wrapper
+    return decorator
+
+
+def setup_rate_limits(app, store=None):
+    for key, default in DEFAULT_LIMITS.items():
+        app.config.setdefault(key, os.getenv(key, default))
+    if store is None:
+        backend = os.getenv('RATE_LIMIT_BACKEND', 'local')
+        if backend == 'redis':
+            store = RedisBucketStore(redis_client())
+        elif backend == 'none':
+            store = NullBucketStore()
+        else:
+            store = LocalBucketStore(max_keys=int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000)))
+    app.extensions['rate_limits'] = store
+
+    proxies = int(os.getenv('PROXY_FIX_X_FOR', 0))
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
@@ -0,0 +1,143 @@
+"""
+Canal en tiempo real de mensajes mediante Server-Sent Events. Las rutas publican eventos por usuario
+en un broker: InProcessBroker (un solo proceso, desarrollo) o RedisBroker (pub/sub compartido entre
+workers, producción) según REALTIME_BACKEND.
+
+Cada stream abierto ocupa un hilo del worker gthread durante hasta STREAM_MAX_SECONDS, así que por
+proceso solo se admiten REALTIME_MAX_STREAMS (4, muy por debajo de los 16 hilos del Procfile); el resto
+recibe 503 con Retry-After y el cliente debe seguir sondeando hasta reintentar.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from flask import current_app
+
+HEARTBEAT_SECONDS = 15
+STREAM_MAX_SECONDS = 300  # el navegador reconecta solo; así se liberan los hilos periódicamente
+MAX_STREAMS = 4
+
+
+class InProcessBroker:
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait({'event': event, 'data': data})
+            except queue.Full:
+                pass  # cliente lento: se descarta el evento; recuperará el estado al recargar
+
+    def subscribe(self, user_id):
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers[user_id].add(subscriber)
+        return InProcessSubscription(self, user_id, subscriber)
+
+    def _unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            self._subscribers[user_id].discard(subscriber)
+            if not self._subscribers[user_id]:
+                del self._subscribers[user_id]
+
+
+class InProcessSubscription:
+    def __init__(self, broker, user_id, subscriber):
+        self.broker = broker
+        self.user_id = user_id
+        self.subscriber = subscriber
+
+    def get(self, timeout):
+        try:
+            return self.subscriber.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self.user_id, self.subscriber)
+
+
+class RedisBroker:
+    def __init__(self, client, prefix='events:user:'):
+        self.client = client
+        self.prefix = prefix
+
+    def publish(self, user_id, event, data):
+        self.client.publish(f"{self.prefix}{user_id}", json.dumps({'event': event, 'data': data}))
+
+    def subscribe(self, user_id):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(f"{self.prefix}{user_id}")
+        return RedisSubscription(pubsub)
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    def get(self, timeout):
+        message = self.pubsub.get_message(timeout=timeout)
+        return json.loads(message['data']) if message else None
+
+    def close(self):
+        self.pubsub.close()
+
+
+def setup_realtime(app, broker=None):
+    app.config.setdefault('REALTIME_BACKEND', os.getenv('REALTIME_BACKEND', 'local'))
+    if broker is None:
+        if app.config['REALTIME_BACKEND'] == 'redis':
+            from api.cache import redis_client
+            broker = RedisBroker(redis_client())
+        else:
+            broker = InProcessBroker()
+    app.extensions['realtime'] = broker
+    app.extensions['realtime_streams'] = threading.BoundedSemaphore(
+        int(os.getenv('REALTIME_MAX_STREAMS', MAX_STREAMS)))
+
+
+def publish(user_id, event, data):
+    broker = current_app.extensions.get('realtime')
+    if broker is not None and user_id is not None:
+        broker.publish(int(user_id), event, data)
+
+
+def subscribe(user_id):
+    return current_app.extensions['realtime'].subscribe(int(user_id))
+
+
+def acquire_stream_slot():
+    """Reserva un hilo para un stream. Devuelve la función que lo libera, o None si ya hay
+    REALTIME_MAX_STREAMS streams abiertos en este proceso."""
+    slots = current_app.extensions['realtime_streams']
+    if not slots.acquire(blocking=False):
+        return None
+    released = threading.Event()
+
+    def release():
+        if not released.is_set():
+            released.set()
+            slots.release()
+    return release
+
+
+def sse_stream(subscription, heartbeat=HEARTBEAT_SECONDS, max_seconds=STREAM_MAX_SECONDS):
+    """Generador de eventos SSE; envía un comentario de keep-alive si no hay eventos en `heartbeat` s."""
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield "retry: 3000\n\n"
+        while time.monotonic() < deadline:
+            payload = subscription.get(timeout=heartbeat)
+            if payload is None:
+                yield ": ping\n\n"
+                continue
+            yield f"event: {payload['event']}\ndata: {json.dumps(payload['data'])}\n\n"
+    finally:
+        subscription.close()
@@ -1,22 +1,35 @@
-from flask import Flask, request, jsonify, url_for, Blueprint
+from flask import Flask, Response, request, jsonify, url_for, Blueprint, make_response
 from flask_cors import CORS
 from flask_jwt_extended import get_jwt_identity, jwt_required, create_access_token, get_jwt
-from werkzeug.security import check_password_hash, generate_password_hash
-from api.utils import generate_sitemap, APIException
-from api.models import db, Users, Products, Favorites, Messages, Comments, Orders, OrderItems
+from api.utils import generate_sitemap, APIException, MAX_PAGE_LIMIT, parse_limit, paginate_keyset
+from api.models import db, Users, Products, ProductCards, Favorites, Messages, Comments, Orders
+from api.cache import cached_response, catalog_key, trending_key, product_key, seller_key, invalidate_product, get_cache, \
+    not_modified, not_modified_response, set_validators
+from api.realtime import publish, subscribe, sse_stream, acquire_stream_slot
+from api.mailer import enqueue_email, notify_mailer
+from api.payments import PaymentUnavailable, get_gateway
+from api.webhooks import record_event, notify_webhooks
+from api.orders import place_order, release_order
+from api.passwords import hash_password, verify_password, needs_rehash
+from api.ratelimit import rate_limit, LOGIN_LIMITS, FORGOT_LIMITS, REGISTER_LIMITS
+from api.favorites import favorite_map, insert_favorite, invalidate_favorites, record_favorite_change
+from api.geo import MAX_RADIUS_KM, parse_coordinates, distance_km
+from api.search import SEARCH_MODES, SUGGEST_LIMIT, FUZZY_MAX_RESULTS, FACET_FIELDS, facet_counts, within_bbox, within_radius, squared_distance, full_text_search, fuzzy_search, substring_search, index_product, unindex_product, reindex_products, prefix_index
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
-from werkzeug.security import generate_password_hash
+import logging
 import os
 from flask import current_app as app
-from flask_mail import Mail, Message
 from sqlalchemy import or_, func
+from sqlalchemy.orm import joinedload, selectinload
 import stripe
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 
 api = Blueprint('api', __name__)
@@ -34,6 +47,16 @@ VALID_CATEGORIES = [
     'Bicicletas'
 ]
 
+# Ordenaciones del listado: columnas de la clave del cursor y si el orden es descendente
+PRODUCT_SORTS = {
+    'recent': ([Products.created_at, Products.id], True),
+    'oldest': ([Products.created_at, Products.id], False),
+    'price_asc': ([Products.price, Products.id], False),
+    'price_desc': ([Products.price, Products.id], True),
+    'popular': ([Products.favorite_count, Products.id], True)
+}
+PRODUCT_SORT_ALIASES = {'desc': 'recent', 'asc': 'oldest'}
+
 def generate_reset_token(email):
     serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
     return serializer.dumps(email, salt='password-reset')
@@ -53,30 +76,54 @@ def handle_hello():
 @api.route('/create-payment-intent', methods=['POST'])
 @jwt_required()
 def create_payment_intent():
-    try:
-        data = request.get_json()
-        product_id = data.get('product_id')
-        
-        product = Products.query.get(product_id)
+    claims = get_jwt()
+    data = request.get_json()
+
+    if data.get('order_id'):
+        # Pago de un pedido ya creado (sus productos están reservados para el comprador)
+        order = db.session.get(Orders, data['order_id'])
+        if order is None or order.user_id != claims['user_id']:
+            return jsonify({"error": "Pedido no encontrado"}), 404
+        if order.status != 'pending':
+            return jsonify({"error": "El pedido no está pendiente de pago"}), 409
+        amount, reference = order.total, {'order_id': order.id}
+    else:
+        product = db.session.get(Products, data.get('product_id'))
         if not product:
             return jsonify({"error": "Producto no encontrado"}), 404
-        
-        intent = stripe.PaymentIntent.create(
-            amount=int(float(product.price) * 100), 
-            currency='eur',
-            metadata={
-                'product_id': product_id,
-                'user_id': get_jwt_identity()
-            }
-        )
-        
-        return jsonify({
-            'clientSecret': intent.client_secret
-        })
-        
-    except Exception as e:
-        print(f"Error al crear el pago: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        if not product.available:
+            return jsonify({"error": "Producto no disponible"}), 409
+        amount, reference = product.price, {'product_id': product.id}
+
+    try:
+        client_secret = get_gateway().create_payment_intent(
+            claims['user_id'], int(round(float(amount) * 100)), **reference)
+    except PaymentUnavailable as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    except stripe.StripeError as e:
+        logger.exception("Error al crear el pago")
+        return jsonify({"error": e.user_message or "Error al crear el pago"}), 502
+
+    return jsonify({
+        'clientSecret': client_secret
+    })
+
+@api.route('/stripe/webhook', methods=['POST'])
+def stripe_webhook():
+    # Solo se verifica y se guarda el evento; el procesado lo hace el worker de api.webhooks
+    try:
+        event = get_gateway().construct_event(request.get_data(), request.headers.get('Stripe-Signature'))
+    except (ValueError, stripe.SignatureVerificationError):
+        return {"message": "Firma o cuerpo del webhook no válidos."}, 400
+    except RuntimeError:
+        logger.exception("Webhook de Stripe sin configurar")
+        return {"message": "Webhook no configurado."}, 503
+
+    if record_event(event.to_dict()):
+        notify_webhooks()
+    return {"received": True}, 200
 
 # USERS ----------------------------------------------------------------------
 @api.route('/users', methods=['GET'])
@@ -88,10 +135,15 @@ def get_users():
 
 @api.route('/users/<int:user_id>', methods=['GET'])
 def get_user(user_id):
-    user = Users.query.filter_by(id=user_id, is_active=True).first()
-    if user is None:
+    validators = db.session.query(Users.version, Users.updated_at).filter_by(id=user_id, is_active=True).first()
+    if validators is None:
         return {"message": "Usuario no encontrado."}, 404
-    return {"results": user.serialize()}, 200
+    etag = f"user-{user_id}-v{validators.version}"
+    if not_modified(etag, validators.updated_at):
+        return not_modified_response(etag, validators.updated_at)
+
+    user = Users.query.get(user_id)
+    return set_validators(make_response({"results": user.serialize()}), etag, user.updated_at)
 
 @api.route('/users/<int:user_id>', methods=['PUT'])
 @jwt_required()
@@ -108,8 +160,11 @@ def update_user(user_id):
     user.first_name = data.get("first_name", user.first_name)
     user.last_name = data.get("last_name", user.last_name)
     user.email = data.get("email", user.email)
+    ProductCards.refresh_seller(user)
 
     db.session.commit()
+    get_cache().bump_version('catalog')
+    get_cache().delete(seller_key(user.id))
     return {"results": user.serialize()}, 200
 
 @api.route('/users/<int:user_id>', methods=['DELETE'])
@@ -125,11 +180,19 @@ def delete_user(user_id):
 
     user.is_active = False
     db.session.commit()
+    get_cache().delete(seller_key(user.id))
 
     return {"results": "Usuario desactivado correctamente."}, 200
 
 # PRODUCTS -------------------------------------------------------------------
+def serialize_listing(card, geo_center=None):
+    result = card.serialize()
+    if geo_center is not None:
+        result['distance_km'] = round(distance_km(*geo_center, card.latitude, card.longitude), 2)
+    return result
+
 @api.route('/products', methods=['GET'])
+@cached_response(catalog_key)
 def get_products():
     search_query = request.args.get('q', '').strip()
     category = request.args.get('category', '').strip()
@@ -137,16 +200,6 @@ def get_products():
 
     query = Products.query.filter_by(available=True)
 
-    if search_query:
-        search_term = f"%{search_query}%"
-        query = query.filter(
-            or_(
-                Products.title.ilike(search_term),
-                Products.description.ilike(search_term),
-                func.cast(Products.category, db.Text).ilike(search_term)
-            )
-        )
-
     if category:
         if category not in VALID_CATEGORIES:
             return {"message": f"Categoría inválida. Debe ser una de: {', '.join(VALID_CATEGORIES)}"}, 400
@@ -158,19 +211,162 @@ def get_products():
             return {"message": f"Estado inválido. Debe ser uno de: {', '.join(valid_tags)}"}, 400
         query = query.filter(Products.tags == tags)
 
+    for param, condition in (('min_price', Products.price.__ge__), ('max_price', Products.price.__le__)):
+        if request.args.get(param):
+            try:
+                query = query.filter(condition(float(request.args[param])))
+            except ValueError:
+                return {"message": f"El parámetro {param} debe ser numérico."}, 400
+
+    since = request.args.get('since', '').strip()
+    if since:
+        try:
+            query = query.filter(Products.created_at >= datetime.fromisoformat(since))
+        except ValueError:
+            return {"message": "Formato de fecha inválido para since"}, 400
+
+    # Cercanía: lat/lng + radius_km (km) o bbox=min_lat,min_lng,max_lat,max_lng
+    geo_center = None
+    if request.args.get('lat') or request.args.get('lng'):
+        try:
+            geo_center = parse_coordinates(request.args.get('lat'), request.args.get('lng'))
+            radius_km = float(request.args.get('radius_km', 25))
+        except (TypeError, ValueError):
+            return {"message": "Parámetros lat, lng o radius_km inválidos."}, 400
+        if not 0 < radius_km <= MAX_RADIUS_KM:
+            return {"message": f"radius_km debe estar entre 0 y {MAX_RADIUS_KM}."}, 400
+        query = within_radius(query, *geo_center, radius_km)
+    elif request.args.get('bbox'):
+        try:
+            min_lat, min_lng, max_lat, max_lng = [float(value) for value in request.args['bbox'].split(',')]
+            parse_coordinates(min_lat, min_lng)
+            parse_coordinates(max_lat, max_lng)
+        except ValueError:
+            return {"message": "Parámetro bbox inválido. Formato: min_lat,min_lng,max_lat,max_lng"}, 400
+        query = within_bbox(query, min_lat, min_lng, max_lat, max_lng)
+
+    sort = request.args.get('sort', 'relevance' if search_query else 'recent').strip()
+    sort = PRODUCT_SORT_ALIASES.get(sort, sort)
+    if sort not in PRODUCT_SORTS and not (sort == 'relevance' and search_query) \
+            and not (sort == 'distance' and geo_center):
+        return {"message": f"Orden inválido. Debe ser uno de: {', '.join(['relevance', 'distance', *PRODUCT_SORTS])}"}, 400
+    # relevance y distance no se paginan por cursor: se devuelven los N primeros
+    ranked = sort in ('relevance', 'distance')
+
+    cursor = request.args.get('cursor', '').strip()
+    paginated = bool(cursor) or 'limit' in request.args
+    if ranked and cursor:
+        return {"message": "El orden por relevancia no admite cursor."}, 400
+
+    max_results = None
+    if search_query:
+        search_mode = request.args.get('mode', 'fulltext').strip()
+        if search_mode not in SEARCH_MODES:
+            return {"message": f"Modo de búsqueda inválido. Debe ser uno de: {', '.join(SEARCH_MODES)}"}, 400
+        if search_mode == 'substring':
+            query = substring_search(query, search_query)
+        elif search_mode == 'fuzzy':
+            query = fuzzy_search(query, search_query, ranked=sort == 'relevance')
+            max_results = FUZZY_MAX_RESULTS
+        else:
+            query = full_text_search(query, search_query, ranked=sort == 'relevance')
+    if sort == 'distance':
+        query = query.order_by(squared_distance(*geo_center), Products.id)
+
+    # facets=1 devuelve todos los conteos; facets=category,tags solo los indicados
+    facets = None
+    requested_facets = request.args.get('facets', '').strip()
+    if requested_facets:
+        facet_fields = FACET_FIELDS if requested_facets.lower() in ('1', 'true') else \
+            [field.strip() for field in requested_facets.split(',') if field.strip()]
+        invalid_fields = [field for field in facet_fields if field not in FACET_FIELDS]
+        if invalid_fields:
+            return {"message": f"Facetas inválidas. Deben ser de: {', '.join(FACET_FIELDS)}"}, 400
+        facets = facet_counts(query, facet_fields)
+
+    # Los filtros y el orden se resuelven sobre products; el contenido se lee de product_cards
+    query = query.join(ProductCards, ProductCards.product_id == Products.id).with_entities(ProductCards)
+
+    if paginated:
+        limit = parse_limit(request.args)
+        if ranked:
+            products, next_cursor = query.limit(min(limit, max_results or limit)).all(), None
+        else:
+            # Paginación por cursor: orden estable sobre (columna de orden, id) aunque se inserten productos nuevos
+            columns, descending = PRODUCT_SORTS[sort]
+            products, next_cursor = paginate_keyset(query, columns, cursor=cursor, limit=limit,
+                                                    descending=descending)
+        response = {
+            "results": [serialize_listing(product, geo_center) for product in products],
+            "pagination": {
+                "next_cursor": next_cursor,
+                "limit": limit
+            }
+        }
+        if facets is not None:
+            response["facets"] = facets
+        return response, 200
+
+    if not ranked:
+        columns, descending = PRODUCT_SORTS[sort]
+        query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+    if max_results:
+        query = query.limit(max_results)
     products = query.all()
 
     if not products:
         return {"message": "No se encontraron productos que coincidan con los criterios."}, 404
 
-    return {"results": [product.serialize() for product in products]}, 200
+    response = {"results": [serialize_listing(product, geo_center) for product in products]}
+    if facets is not None:
+        response["facets"] = facets
+    return response, 200
+
+@api.route('/products/suggest', methods=['GET'])
+def suggest_products():
+    """Sugerencias de autocompletado (categorías y títulos) servidas desde el índice en memoria"""
+    prefix = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', SUGGEST_LIMIT, type=int) or SUGGEST_LIMIT, SUGGEST_LIMIT))
+    return {"results": prefix_index.suggest(prefix, limit=limit)}, 200
+
+@api.route('/products/trending', methods=['GET'])
+@cached_response(trending_key)
+def get_trending_products():
+    """Productos disponibles ordenados por popularidad reciente (favoritos con decaimiento temporal),
+    paginados por cursor sobre el índice (available, trending_score, id)"""
+    query = Products.query.filter(Products.available.is_(True), Products.trending_score > 0)
+    category = request.args.get('category', '').strip()
+    if category:
+        if category not in VALID_CATEGORIES:
+            return {"message": f"Categoría inválida. Debe ser una de: {', '.join(VALID_CATEGORIES)}"}, 400
+        query = query.filter(Products.category == category)
+    query = query.join(ProductCards, ProductCards.product_id == Products.id)\
+        .with_entities(ProductCards, Products.trending_score)
+    limit = parse_limit(request.args)
+    rows, next_cursor = paginate_keyset(query, [Products.trending_score, Products.id],
+                                        cursor=request.args.get('cursor', '').strip(), limit=limit,
+                                        row_values=lambda row: [row.trending_score, row.ProductCards.product_id])
+    return {
+        "results": [serialize_listing(card) for card, _ in rows],
+        "pagination": {
+            "next_cursor": next_cursor,
+            "limit": limit
+        }
+    }, 200
 
 @api.route('/products/<int:product_id>', methods=['GET'])
+@cached_response(product_key)
 def get_product(product_id):
-    product = Products.query.get(product_id)
-    if product is None:
+    # Primero solo la versión: si el cliente ya la tiene se contesta 304 sin cargar ni serializar
+    validators = db.session.query(Products.version, Products.updated_at).filter_by(id=product_id).first()
+    if validators is None:
         return {"message": "Producto no encontrado."}, 404
-    return product.serialize(), 200
+    etag = f"product-{product_id}-v{validators.version}"
+    if not_modified(etag, validators.updated_at):
+        return not_modified_response(etag, validators.updated_at)
+
+    product = Products.query.get(product_id)
+    return set_validators(make_response(product.serialize()), etag, product.updated_at)
 
 @api.route('/products', methods=['POST'])
 @jwt_required()
@@ -192,6 +388,13 @@ def create_product():
 
     images = data.get("images", [])
 
+    coordinates = (None, None)
+    if data.get("latitude") is not None or data.get("longitude") is not None:
+        try:
+            coordinates = parse_coordinates(data.get("latitude"), data.get("longitude"))
+        except (TypeError, ValueError):
+            return {"message": "Coordenadas inválidas."}, 400
+
     new_product = Products(
         user_id=claims['user_id'],
         title=data.get("title"),
@@ -204,9 +407,14 @@ def create_product():
         category=category,
         was_sold=False
     )
+    new_product.set_coordinates(*coordinates)
 
     db.session.add(new_product)
+    db.session.flush()
+    ProductCards.refresh(new_product)
     db.session.commit()
+    index_product(new_product)
+    invalidate_product(new_product.id, new_product.user_id)
     return {"results": new_product.serialize()}, 201
 
 @api.route('/products/<int:product_id>', methods=['PUT'])
@@ -232,6 +440,15 @@ def update_product(product_id):
     if images is not None:
         product.image_urls = images
 
+    if "latitude" in data or "longitude" in data:
+        coordinates = (None, None)
+        if data.get("latitude") is not None or data.get("longitude") is not None:
+            try:
+                coordinates = parse_coordinates(data.get("latitude"), data.get("longitude"))
+            except (TypeError, ValueError):
+                return {"message": "Coordenadas inválidas."}, 400
+        product.set_coordinates(*coordinates)
+
     product.tags = data.get("tags", product.tags)
     product.was_sold = data.get("was_sold", product.was_sold)
 
@@ -241,7 +458,10 @@ def update_product(product_id):
             return {"message": f"Categoría inválida. Debe ser una de: {', '.join(VALID_CATEGORIES)}"}, 400
         product.category = new_category
 
+    ProductCards.refresh(product)
     db.session.commit()
+    index_product(product)
+    invalidate_product(product.id, product.user_id)
     return {"results": product.serialize()}, 200
 
 @api.route('/products/<int:product_id>', methods=['DELETE'])
@@ -259,8 +479,11 @@ def delete_product(product_id):
     if product.was_sold:
         return {"message": "Este producto ya fue vendido y no puede eliminarse."}, 403
 
+    ProductCards.query.filter_by(product_id=product_id).delete()
     db.session.delete(product)
     db.session.commit()
+    unindex_product(product_id)
+    invalidate_product(product_id, product.user_id)
     return {"message": "Producto eliminado correctamente."}, 200
 
 @api.route('/products/user', methods=['GET'])
@@ -279,17 +502,18 @@ def get_products_by_user():
     }, 200
 
 @api.route('/products/user/<int:user_id>', methods=['GET'])
+@cached_response(seller_key)
 def get_products_by_user_id(user_id):
     user = Users.query.filter_by(id=user_id, is_active=True).first()
     if user is None:
         return {"message": "Usuario no encontrado."}, 404
 
-    products = Products.query.filter_by(user_id=user_id).all()
-    if not products:
+    cards = ProductCards.query.filter_by(user_id=user_id).order_by(ProductCards.created_at.desc()).all()
+    if not cards:
         return {"message": "Este usuario no ha publicado productos.", "results": []}, 200
 
     return {
-        "results": [product.serialize() for product in products],
+        "results": [card.serialize() for card in cards],
         "message": f"Productos publicados por {user.first_name} {user.last_name}"
     }, 200
 
@@ -299,7 +523,29 @@ def get_products_by_user_id(user_id):
 def get_favorites():
     claims = get_jwt()
     current_user_id = claims['user_id']
-    
+
+    cursor = request.args.get('cursor', '').strip()
+    if cursor or 'limit' in request.args:
+        # Modo cursor: sin COUNT ni OFFSET; el total sale del conjunto de favoritos en caché
+        limit = parse_limit(request.args)
+        query = db.session.query(Favorites.id, ProductCards)\
+            .join(ProductCards, ProductCards.product_id == Favorites.product_id)\
+            .filter(Favorites.user_id == current_user_id)
+        rows, next_cursor = paginate_keyset(query, [Favorites.id], cursor=cursor, limit=limit,
+                                            row_values=lambda row: [row.id])
+        return {
+            "results": [{
+                "favorite_id": favorite_id,
+                "product_id": card.product_id,
+                "product": card.serialize()
+            } for favorite_id, card in rows],
+            "pagination": {
+                "next_cursor": next_cursor,
+                "limit": limit,
+                "total": len(favorite_map(current_user_id))
+            }
+        }, 200
+
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
     
@@ -342,23 +588,33 @@ def get_favorites():
         }
     }, 200
 
+@api.route('/favorites/check', methods=['GET'])
+@jwt_required()
+def check_favorites():
+    """Estado de favorito de varios productos a la vez: ?ids=1,2,3 -> {"results": {"1": favorite_id | null}}"""
+    claims = get_jwt()
+    try:
+        product_ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return {"message": "El parámetro ids debe ser una lista de enteros separados por comas."}, 400
+    if len(product_ids) > MAX_PAGE_LIMIT:
+        return {"message": f"Como máximo {MAX_PAGE_LIMIT} productos por consulta."}, 400
+
+    favorites = favorite_map(claims['user_id'])
+    return {"results": {str(product_id): favorites.get(product_id) for product_id in product_ids}}, 200
+
 @api.route('/favorites/check/<int:product_id>', methods=['GET'])
 @jwt_required()
 def check_favorite(product_id):
     claims = get_jwt()
     current_user_id = claims['user_id']
-    
-    favorite = db.session.execute(
-        db.select(Favorites).where(
-            Favorites.user_id == current_user_id,
-            Favorites.product_id == product_id
-        )
-    ).scalar()
-    
-    if favorite:
+
+    favorite_id = favorite_map(current_user_id).get(product_id)
+
+    if favorite_id:
         return {
             "is_favorite": True,
-            "favorite_id": favorite.id
+            "favorite_id": favorite_id
         }, 200
     else:
         return {
@@ -384,27 +640,27 @@ def create_favorite():
     if not product:
         return {"message": "El producto no existe"}, 400
 
-    existing_favorite = db.session.execute(
-        db.select(Favorites).where(
-            Favorites.user_id == current_user_id,
-            Favorites.product_id == data["product_id"]
-        )
-    ).scalar()
-    
-    if existing_favorite:
+    # INSERT ... ON CONFLICT DO NOTHING sobre el índice único (user_id, product_id)
+    created_at = datetime.utcnow()
+    favorite_id, created = insert_favorite(current_user_id, product.id, created_at)
+    if not created:
+        db.session.rollback()
         return {
             "message": "Este producto ya está en tus favoritos",
-            "favorite_id": existing_favorite.id,
+            "favorite_id": favorite_id,
             "already_exists": True
         }, 200
 
-    fav = Favorites(user_id=current_user_id, product_id=data['product_id'])
-    db.session.add(fav)
+    record_favorite_change(product.id, created_at, 1)
+    ProductCards.refresh_favorite_count(product.id)
     db.session.commit()
-    
+    invalidate_favorites(current_user_id)
+    # favorite_count y trending_score ordenan ?sort=popular y /products/trending
+    get_cache().bump_version('catalog')
+
     return {
         "message": "Favorito creado",
-        "favorite_id": fav.id,
+        "favorite_id": favorite_id,
         "already_exists": False
     }, 201
 
@@ -420,36 +676,39 @@ def delete_favorite(id):
         return {"error": "No autorizado para eliminar este favorito."}, 403
 
     db.session.delete(fav)
+    db.session.flush()
+    record_favorite_change(fav.product_id, fav.created_at, -1)
+    ProductCards.refresh_favorite_count(fav.product_id)
     db.session.commit()
+    invalidate_favorites(fav.user_id)
+    get_cache().bump_version('catalog')
     return {"message": "Favorito eliminado correctamente."}, 200
 
 # MESSAGES -------------------------------------------------------------------
+def adjust_unread_count(user_id, delta):
+    """Suma `delta` al contador de no leídos del usuario en la transacción actual (UPDATE atómico)"""
+    Users.query.filter_by(id=user_id)\
+        .update({Users.unread_count: Users.unread_count + delta}, synchronize_session=False)
+
 @api.route('/messages', methods=['GET'])
 @jwt_required()
 def get_messages():
     try:
-        print("🔍 Ruta /messages llamada")
         claims = get_jwt()
-        print(f"👤 Usuario autenticado: {claims.get('user_id')}")
-        
-        rows = Messages.query.all()
-        print(f"📨 Mensajes encontrados: {len(rows) if rows else 0}")
-        
-        if rows:
-            serialized_messages = [row.serialize() for row in rows]
-            print(f"✅ Mensajes serializados: {len(serialized_messages)}")
-        else:
-            serialized_messages = []
-            print("ℹ️ No hay mensajes, devolviendo array vacío")
-        
+        # Solo los mensajes enviados o recibidos por el usuario autenticado
+        current_user_id = claims['user_id']
+        rows = Messages.query.filter(
+            or_(Messages.user_sender == current_user_id, Messages.user_receiver == current_user_id)
+        ).order_by(Messages.created_at, Messages.id).all()
+        serialized_messages = [row.serialize() for row in rows]
+        logger.debug("Mensajes cargados", extra={"user_id": current_user_id, "count": len(serialized_messages)})
+
         return {
             "results": serialized_messages,
             "message": "Lista de mensajes cargada correctamente."
         }, 200
     except Exception as e:
-        print(f"💥 Error en get_messages: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error en get_messages")
         return {"message": f"Error interno del servidor: {str(e)}"}, 500
 
 @api.route('/messages', methods=['POST'])
@@ -479,13 +738,20 @@ def create_message():
     message = Messages(
         user_sender=data['user_sender'],
         user_receiver=data['user_receiver'],
+        conversation_key=Messages.conversation_key_for(data['user_sender'], data['user_receiver']),
         content=data['content'],
         created_at=created_at,
         review_date=review_date
     )
     db.session.add(message)
+    if review_date is None:
+        adjust_unread_count(message.user_receiver, 1)
     db.session.commit()
-    return {"results": message.serialize(), "message": "Mensaje creado correctamente"}, 201
+
+    payload = message.serialize()
+    publish(message.user_receiver, 'message', payload)
+    publish(message.user_sender, 'message', payload)
+    return {"results": payload, "message": "Mensaje creado correctamente"}, 201
 
 @api.route('/messages/<int:message_id>/read', methods=['PUT'])
 @jwt_required()
@@ -498,22 +764,148 @@ def mark_message_as_read(message_id):
     if message.user_receiver != claims['user_id']:
         return {"message": "No autorizado"}, 403
     
-    message.review_date = datetime.utcnow()
+    # UPDATE condicional: con dos peticiones simultáneas solo una lo marca y descuenta el contador
+    review_date = datetime.utcnow()
+    updated = Messages.query.filter(Messages.id == message_id, Messages.review_date.is_(None))\
+        .update({Messages.review_date: review_date}, synchronize_session=False)
+    if updated:
+        adjust_unread_count(message.user_receiver, -updated)
     db.session.commit()
-    
+
+    if updated:
+        publish(message.user_sender, 'read', {"ids": [message_id], "review_date": review_date.isoformat()})
     return {"message": "Mensaje marcado como leído"}, 200
 
+@api.route('/messages/unread-count', methods=['GET'])
+@jwt_required()
+def get_unread_count():
+    unread_count = db.session.query(Users.unread_count).filter_by(id=get_jwt()['user_id']).scalar()
+    return {"unread_count": unread_count or 0}, 200
+
+@api.route('/messages/conversations/<int:other_user_id>/read', methods=['PUT'])
+@jwt_required()
+def mark_conversation_as_read(other_user_id):
+    """Marca como leídos todos los mensajes recibidos de una conversación en una sola sentencia"""
+    current_user_id = get_jwt()['user_id']
+    conversation_key = Messages.conversation_key_for(current_user_id, other_user_id)
+    review_date = datetime.utcnow()
+    updated = Messages.query.filter(
+        Messages.conversation_key == conversation_key,
+        Messages.user_receiver == current_user_id,
+        Messages.review_date.is_(None)
+    ).update({Messages.review_date: review_date}, synchronize_session=False)
+    if updated:
+        adjust_unread_count(current_user_id, -updated)
+    db.session.commit()
+
+    if updated:
+        publish(other_user_id, 'read', {"conversation_key": conversation_key, "review_date": review_date.isoformat()})
+    return {"message": "Conversación marcada como leída", "updated": updated}, 200
+
+@api.route('/messages/stream', methods=['GET'])
+@jwt_required(locations=['query_string'])
+def stream_messages():
+    """
+    Server-Sent Events con los mensajes nuevos ('message') y confirmaciones de lectura ('read') del
+    usuario. EventSource no permite cabeceras: el token se envía como ?jwt=<token> (solo en esta ruta).
+    """
+    release_slot = acquire_stream_slot()
+    if release_slot is None:
+        return {"message": "Demasiadas conexiones en tiempo real; vuelve a intentarlo más tarde."}, 503, \
+            {'Retry-After': '30'}
+    subscription = subscribe(get_jwt()['user_id'])
+    response = Response(sse_stream(subscription), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # close() se llama aunque el generador no llegue a arrancar (cliente desconectado antes)
+    response.call_on_close(release_slot)
+    response.call_on_close(subscription.close)
+    return response
+
+@api.route('/messages/conversations', methods=['GET'])
+@jwt_required()
+def get_conversations():
+    """Bandeja de entrada: una entrada por conversación con su último mensaje y los no leídos"""
+    current_user_id = get_jwt()['user_id']
+
+    latest_ids = db.session.query(func.max(Messages.id))\
+        .filter(or_(Messages.user_sender == current_user_id, Messages.user_receiver == current_user_id))\
+        .group_by(Messages.conversation_key)
+    last_messages = Messages.query.filter(Messages.id.in_(latest_ids))\
+        .order_by(Messages.created_at.desc(), Messages.id.desc()).all()
+
+    unread = dict(db.session.query(Messages.conversation_key, func.count(Messages.id))
+                  .filter(Messages.user_receiver == current_user_id, Messages.review_date.is_(None))
+                  .group_by(Messages.conversation_key).all())
+
+    other_ids = {message.user_receiver if message.user_sender == current_user_id else message.user_sender
+                 for message in last_messages}
+    users = {user.id: user for user in Users.query.filter(Users.id.in_(other_ids)).all()} if other_ids else {}
+
+    results = []
+    for message in last_messages:
+        other_id = message.user_receiver if message.user_sender == current_user_id else message.user_sender
+        other = users.get(other_id)
+        results.append({
+            "conversation_key": message.conversation_key,
+            "other_user_id": other_id,
+            "other_user_name": f"{other.first_name} {other.last_name}" if other else None,
+            "last_message": message.serialize(),
+            "unread_count": unread.get(message.conversation_key, 0)
+        })
+
+    return {"results": results, "message": "Conversaciones cargadas correctamente."}, 200
+
+@api.route('/messages/conversations/<int:other_user_id>', methods=['GET'])
+@jwt_required()
+def get_conversation(other_user_id):
+    """Mensajes de una conversación, del más reciente al más antiguo, paginados por cursor"""
+    current_user_id = get_jwt()['user_id']
+    query = Messages.query.filter_by(
+        conversation_key=Messages.conversation_key_for(current_user_id, other_user_id))
+    limit = parse_limit(request.args)
+    messages, next_cursor = paginate_keyset(query, [Messages.created_at, Messages.id],
+                                            cursor=request.args.get('cursor', '').strip(), limit=limit)
+    return {
+        "results": [message.serialize() for message in messages],
+        "pagination": {
+            "next_cursor": next_cursor,
+            "limit": limit
+        }
+    }, 200
+
 # COMMENTS -------------------------------------------------------------------
 @api.route('/comments/profile/<int:profile_user_id>', methods=['GET'])
 def get_profile_comments(profile_user_id):
     """Obtener comentarios de un perfil específico"""
-    comments = Comments.query.filter_by(profile_user_id=profile_user_id).order_by(Comments.created_at.desc()).all()
+    # ETag a partir de número de comentarios, último id y última modificación de los autores
+    total, last_id, authors_updated_at = db.session.query(
+        func.count(Comments.id), func.max(Comments.id), func.max(Users.updated_at)
+    ).join(Users, Comments.user_id == Users.id).filter(Comments.profile_user_id == profile_user_id).one()
+    etag = f"comments-{profile_user_id}-{total}-{last_id or 0}-{authors_updated_at.timestamp() if authors_updated_at else 0}"
+    if not_modified(etag):
+        return not_modified_response(etag)
+
+    # Los autores se cargan en la misma consulta (JOIN) en lugar de un SELECT por comentario
+    query = Comments.query.options(joinedload(Comments.user)).filter(Comments.profile_user_id == profile_user_id)
+    cursor = request.args.get('cursor', '').strip()
+    if cursor or 'limit' in request.args:
+        limit = parse_limit(request.args)
+        comments, next_cursor = paginate_keyset(query, [Comments.created_at, Comments.id], cursor=cursor, limit=limit)
+        return set_validators(make_response({
+            "results": [comment.serialize() for comment in comments],
+            "pagination": {
+                "next_cursor": next_cursor,
+                "limit": limit
+            }
+        }), etag)
+
+    comments = query.order_by(Comments.created_at.desc(), Comments.id.desc()).all()
     if not comments:
-        return {"message": "No hay comentarios en este perfil.", "results": []}, 200
-    return {
+        return set_validators(make_response({"message": "No hay comentarios en este perfil.", "results": []}), etag)
+    return set_validators(make_response({
         "results": [comment.serialize() for comment in comments],
         "message": "Comentarios del perfil cargados correctamente."
-    }, 200
+    }), etag)
 
 @api.route('/comments', methods=['POST'])
 @jwt_required()
@@ -568,19 +960,43 @@ def delete_comment(comment_id):
 @api.route('/orders', methods=['GET'])
 @jwt_required()
 def get_orders():
+    """Historial de pedidos, del más reciente al más antiguo, paginado por cursor. Cada pedido incluye sus
+    líneas con la tarjeta del producto (3 consultas por página: pedidos, líneas y tarjetas)."""
     claims = get_jwt()
     user_role = claims.get('role')
     user_id = claims.get('user_id')
 
-    if user_role == 'admin':
-        orders = Orders.query.all()
-    else:
-        orders = Orders.query.filter_by(user_id=user_id).all()
+    query = Orders.query.options(selectinload(Orders.items))
+    if user_role != 'admin':
+        query = query.filter(Orders.user_id == user_id)
+    status = request.args.get('status', '').strip()
+    if status:
+        if status not in Orders.status.type.enums:
+            return {"message": f"Estado inválido. Debe ser uno de: {', '.join(Orders.status.type.enums)}"}, 400
+        query = query.filter(Orders.status == status)
 
-    if not orders:
-        return {"message": "No hay pedidos."}, 404
+    limit = parse_limit(request.args)
+    orders, next_cursor = paginate_keyset(query, [Orders.created_at, Orders.id],
+                                          cursor=request.args.get('cursor', '').strip(), limit=limit)
 
-    return {"results": [order.serialize() for order in orders]}, 200
+    product_ids = {item.product_id for order in orders for item in order.items}
+    cards = {card.product_id: card for card in
+             ProductCards.query.filter(ProductCards.product_id.in_(product_ids)).all()} if product_ids else {}
+
+    results = []
+    for order in orders:
+        serialized = order.serialize()
+        serialized['items'] = [dict(item.serialize(),
+                                    product=cards[item.product_id].serialize() if item.product_id in cards else None)
+                               for item in order.items]
+        results.append(serialized)
+    return {
+        "results": results,
+        "pagination": {
+            "next_cursor": next_cursor,
+            "limit": limit
+        }
+    }, 200
 
 @api.route('/orders', methods=['POST'])
 @jwt_required()
@@ -589,33 +1005,13 @@ def create_order():
     user_id = claims.get('user_id')
     data = request.get_json()
 
-    if not data or 'order_items' not in data:
+    if not isinstance(data, dict) or 'order_items' not in data:
         return {"message": "Faltan datos para crear el pedido."}, 400
+    if not isinstance(data['order_items'], list) or not all(isinstance(item, dict) for item in data['order_items']):
+        return {"message": "order_items debe ser una lista de objetos con product_id."}, 400
 
-    order = Orders(user_id=user_id, status='pending',
-                   created_at=datetime.utcnow())
-    db.session.add(order)
-    db.session.flush()
-
-    for item in data['order_items']:
-        product_id = item.get('product_id')
-        quantity = item.get('quantity', 1)
-
-        if not product_id:
-            continue
-
-        product = Products.query.get(product_id)
-        if not product:
-            continue
-
-        order_item = OrderItems(
-            order_id=order.id,
-            product_id=product_id,
-            quantity=quantity
-        )
-        db.session.add(order_item)
-
-    db.session.commit()
+    # Una sola consulta con bloqueo para todos los productos; el total se calcula en el servidor
+    order = place_order(user_id, [item.get('product_id') for item in data['order_items']])
 
     return {"results": order.serialize(), "message": "Pedido creado correctamente"}, 201
 
@@ -623,7 +1019,7 @@ def create_order():
 @jwt_required()
 def update_order(order_id):
     claims = get_jwt()
-    order = Orders.query.get(order_id)
+    order = db.session.get(Orders, order_id)
 
     if order is None:
         return {"message": "Pedido no encontrado."}, 404
@@ -632,8 +1028,20 @@ def update_order(order_id):
         return {"message": "No autorizado para modificar este pedido."}, 403
 
     data = request.json
-    order.status = data.get('status', order.status)
+    status = data.get('status', order.status)
+    # El pago lo confirma el webhook de Stripe; el comprador solo puede cancelar
+    if claims.get('role') != 'admin' and status not in (order.status, 'canceled'):
+        return {"message": "Solo se puede cancelar el pedido."}, 403
+    if status == 'canceled' and order.status in ('paid', 'refund_needed'):
+        return {"message": "El pedido ya está pagado."}, 409
+
+    # release_order solo libera en la transición pending -> canceled (repetir la cancelación no hace nada)
+    released = release_order(order) if status == 'canceled' else []
+    order.status = status
     db.session.commit()
+    for product_id, seller_id in released:
+        invalidate_product(product_id, seller_id)
+    reindex_products(product_id for product_id, _ in released)
 
     return {"results": order.serialize(), "message": "Pedido actualizado correctamente"}, 200
 
@@ -641,7 +1049,7 @@ def update_order(order_id):
 @jwt_required()
 def delete_order(order_id):
     claims = get_jwt()
-    order = Orders.query.get(order_id)
+    order = db.session.get(Orders, order_id)
 
     if order is None:
         return {"message": "Pedido no encontrado."}, 404
@@ -649,13 +1057,20 @@ def delete_order(order_id):
     if claims.get('role') != 'admin' and claims.get('user_id') != order.user_id:
         return {"message": "No autorizado para eliminar este pedido."}, 403
 
+    released = release_order(order)
+    for item in order.items:
+        db.session.delete(item)
     db.session.delete(order)
     db.session.commit()
+    for product_id, seller_id in released:
+        invalidate_product(product_id, seller_id)
+    reindex_products(product_id for product_id, _ in released)
 
     return {"message": "Pedido eliminado correctamente."}, 200
 
 # AUTH ----------------------------------------------------------------------
 @api.route('/register', methods=['POST'])
+@rate_limit(*REGISTER_LIMITS)
 def register():
     data = request.json
     email = data.get('email', '').lower()
@@ -672,7 +1087,7 @@ def register():
 
     user = Users(
         email=email,
-        password=generate_password_hash(password),
+        password=hash_password(password),
         is_active=True,
         role=role,
         first_name=first_name,
@@ -699,6 +1114,7 @@ def register():
     }, 201
 
 @api.route("/login", methods=["POST"])
+@rate_limit(*LOGIN_LIMITS)
 def login():
     data = request.json
     email = data.get("email", "").lower()
@@ -709,9 +1125,14 @@ def login():
 
     user = Users.query.filter_by(email=email, is_active=True).first()
 
-    if not user or not check_password_hash(user.password, password):
+    if not verify_password(user.password if user else None, password):
         return {"msg": "Email o contraseña incorrectos."}, 401
 
+    # Si el hash se generó con otro algoritmo o coste, se regenera ahora que tenemos la contraseña
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+        db.session.commit()
+
     claims = {
         "user_id": user.id,
         "role": user.role,
@@ -728,18 +1149,19 @@ def login():
     }, 200
 
 @api.route('/password/forgot', methods=['POST'])
+@rate_limit(*FORGOT_LIMITS)
 def forgot_password():
-    from app import mail
     data = request.get_json()
     email = data.get('email')
     user = Users.query.filter_by(email=email).first()
     if user:
         token = generate_reset_token(email)
-        reset_url = f"{os.getenv("VITE_FRONTEND_URL")}/reset-password/{token}"
-        msg=Message(subject="Recuperación de contraseña",
-                      recipients=[email],
-                      body=f"Hola {user.first_name},\n\nHaz clic en el siguiente enlace para cambiar tu contraseña:\n{reset_url}\n\nEste enlace expirará en 1 hora.")
-        mail.send(msg)
+        reset_url = f"{os.getenv('VITE_FRONTEND_URL')}/reset-password/{token}"
+        # El envío SMTP lo hace el worker del outbox, fuera de la petición
+        enqueue_email(email, "Recuperación de contraseña",
+                      f"Hola {user.first_name},\n\nHaz clic en el siguiente enlace para cambiar tu contraseña:\n{reset_url}\n\nEste enlace expirará en 1 hora.")
+        db.session.commit()
+        notify_mailer()
     return jsonify({"msg": "Si el correo está registrado, se ha enviado un enlace de recuperación."}), 200
 
 @api.route('/password/reset/<token>', methods=['POST'])
@@ -754,7 +1176,7 @@ def reset_password(token):
     if not user:
         return jsonify({"msg": "Usuario no encontrado"}), 404
 
-    user.password = generate_password_hash(new_password)
+    user.password = hash_password(new_password)
     db.session.commit()
 
     return jsonify({"msg": "Contraseña actualizada correctamente."}), 200
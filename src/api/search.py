@@ -0,0 +1,362 @@
+"""
+Búsqueda de productos. En PostgreSQL se usa la columna tsvector `search_vector` (mantenida por trigger
+y con índice GIN); en SQLite la tabla virtual FTS5 `products_fts`. Ambas se crean en las migraciones.
+La búsqueda difusa usa pg_trgm en PostgreSQL y un índice de trigramas en memoria en SQLite.
+"""
+import abc
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from sqlalchemy import and_, or_, case, func, text, literal, literal_column, select, union_all
+from api.models import db, Products
+from api.geo import KM_PER_DEGREE, covering_cells, prefix_upper_bound, radius_bbox
+
+SEARCH_CONFIG = 'spanish'
+SEARCH_MODES = ['fulltext', 'fuzzy', 'substring']
+FUZZY_THRESHOLD = 0.25
+FUZZY_MAX_RESULTS = 50
+# Candidatos del índice en memoria que pasan a la consulta SQL (los filtros se aplican después): acota el IN
+FUZZY_MAX_CANDIDATES = 10000
+INDEX_MAX_AGE = 300  # segundos; recoge cambios hechos por otros workers
+SUGGEST_LIMIT = 8
+FACET_FIELDS = ['category', 'tags', 'location']
+
+
+def dialect_name():
+    return db.session.get_bind().dialect.name
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def normalize(value):
+    value = unicodedata.normalize('NFKD', value.lower())
+    return ''.join(char for char in value if not unicodedata.combining(char))
+
+
+def words(value):
+    return re.findall(r'\w+', normalize(value))
+
+
+def trigrams(word):
+    # Mismo relleno que pg_trgm: dos espacios delante y uno detrás
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def substring_search(query, search_query):
+    search_term = f"%{search_query}%"
+    return query.filter(
+        or_(
+            Products.title.ilike(search_term),
+            Products.description.ilike(search_term),
+            func.cast(Products.category, db.Text).ilike(search_term)
+        )
+    )
+
+
+def facet_counts(query, fields):
+    """
+    Conteos por valor de cada campo de `fields` sobre los productos que cumplen `query`, en una sola
+    consulta (UNION ALL de un GROUP BY por campo). Devuelve {campo: {valor: total}} de mayor a menor.
+    """
+    base = query.order_by(None).limit(None)\
+        .with_entities(*[getattr(Products, field) for field in fields]).subquery()
+    grouped = [
+        select(literal(field).label('facet'), func.cast(base.c[field], db.String).label('value'),
+               func.count().label('total')).group_by(base.c[field])
+        for field in fields
+    ]
+    rows = db.session.execute(union_all(*grouped)).all()
+    facets = {field: [] for field in fields}
+    for facet, value, total in rows:
+        if value is not None:
+            facets[facet].append((value, total))
+    return {field: dict(sorted(values, key=lambda item: -item[1])) for field, values in facets.items()}
+
+
+def within_bbox(query, min_lat, min_lng, max_lat, max_lng):
+    """Productos dentro del rectángulo: rangos sobre el índice de geohash y filtro exacto por lat/lng."""
+    ranges = []
+    for cell in covering_cells(min_lat, min_lng, max_lat, max_lng):
+        upper = prefix_upper_bound(cell)
+        ranges.append(and_(Products.geohash >= cell, Products.geohash < upper) if upper else Products.geohash >= cell)
+    return query.filter(or_(*ranges),
+                        Products.latitude.between(min_lat, max_lat),
+                        Products.longitude.between(min_lng, max_lng))
+
+
+def squared_distance(latitude, longitude):
+    # Aproximación equirrectangular en km², solo aritmética para que funcione en ambos motores
+    scale = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    delta_lat = (Products.latitude - latitude) * KM_PER_DEGREE
+    delta_lng = (Products.longitude - longitude) * scale
+    return delta_lat * delta_lat + delta_lng * delta_lng
+
+
+def within_radius(query, latitude, longitude, radius_km):
+    query = within_bbox(query, *radius_bbox(latitude, longitude, radius_km))
+    return query.filter(squared_distance(latitude, longitude) <= radius_km ** 2)
+
+
+def fts5_match_expression(search_query):
+    # Cada palabra entre comillas (sin sintaxis FTS5 del usuario) y como prefijo: "bici"* "monta"*
+    terms = [term.replace('"', '""') for term in search_query.split()]
+    return ' '.join(f'"{term}"*' for term in terms if term)
+
+
+def full_text_search(query, search_query, ranked=True):
+    """Filtra `query` por `search_query` y, si `ranked`, lo ordena por relevancia."""
+    dialect = dialect_name()
+    if dialect == 'postgresql':
+        ts_query = func.websearch_to_tsquery(literal_column(f"'{SEARCH_CONFIG}'::regconfig"), search_query)
+        query = query.filter(Products.search_vector.op('@@')(ts_query))
+        if ranked:
+            query = query.order_by(func.ts_rank_cd(Products.search_vector, ts_query).desc(), Products.id.desc())
+        return query
+
+    if dialect == 'sqlite':
+        match = fts5_match_expression(search_query)
+        if not match:
+            return query.filter(db.false())
+        # bm25 con pesos por columna: title, description, category (menor es más relevante)
+        fts = text(
+            "SELECT rowid AS product_id, bm25(products_fts, 10.0, 1.0, 4.0) AS rank "
+            "FROM products_fts WHERE products_fts MATCH :match"
+        ).bindparams(match=match).columns(product_id=db.Integer, rank=db.Float).subquery('fts')
+        query = query.join(fts, fts.c.product_id == Products.id)
+        if ranked:
+            query = query.order_by(fts.c.rank, Products.id.desc())
+        return query
+
+    return substring_search(query, search_query)
+
+
+class TitleIndex(abc.ABC):
+    """
+    Índice en memoria sobre los títulos de productos. Se construye la primera vez que se usa,
+    se actualiza con add/remove tras cada escritura y se reconstruye cada INDEX_MAX_AGE segundos.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded_at = None
+
+    @abc.abstractmethod
+    def _reset(self):
+        """Vacía las estructuras del índice antes de una carga completa."""
+
+    @abc.abstractmethod
+    def _add(self, product_id, title, category):
+        """Añade un producto (se llama con el lock tomado)."""
+
+    @abc.abstractmethod
+    def _remove(self, product_id):
+        """Quita un producto si está en el índice (se llama con el lock tomado)."""
+
+    def _finish_load(self):
+        pass
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < INDEX_MAX_AGE:
+                return
+            rows = db.session.query(Products.id, Products.title, Products.category)\
+                .filter(Products.available.is_(True)).all()
+            self._reset()
+            for product_id, title, category in rows:
+                self._add(product_id, title, category)
+            self._finish_load()
+            self._loaded_at = time.monotonic()
+
+    def add(self, product):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._remove(product.id)
+            if product.available:
+                self._add(product.id, product.title, product.category)
+
+    def remove(self, product_id):
+        with self._lock:
+            if self._loaded_at is not None:
+                self._remove(product_id)
+
+
+class NgramIndex(TitleIndex):
+    """Índice invertido trigrama -> ids de producto, para la búsqueda difusa en SQLite."""
+
+    def _reset(self):
+        self._postings = defaultdict(set)
+        self._words = {}
+
+    def _add(self, product_id, title, category):
+        title_words = [(word, trigrams(word)) for word in words(title)]
+        self._words[product_id] = title_words
+        for _, grams in title_words:
+            for gram in grams:
+                self._postings[gram].add(product_id)
+
+    def _remove(self, product_id):
+        for _, grams in self._words.pop(product_id, []):
+            for gram in grams:
+                self._postings[gram].discard(product_id)
+
+    @staticmethod
+    def _word_score(query_word, query_grams, title_words):
+        best = 0.0
+        for word, grams in title_words:
+            if word.startswith(query_word):
+                return 1.0
+            best = max(best, len(query_grams & grams) / len(query_grams | grams))
+        return best
+
+    def search(self, search_query, limit=FUZZY_MAX_RESULTS, threshold=FUZZY_THRESHOLD):
+        """Devuelve [(product_id, score)] ordenado por similitud media de las palabras buscadas."""
+        self.ensure_loaded()
+        query_words = [(word, trigrams(word)) for word in words(search_query)]
+        if not query_words:
+            return []
+        with self._lock:
+            candidates = set()
+            for _, grams in query_words:
+                for gram in grams:
+                    candidates |= self._postings.get(gram, set())
+            scored = []
+            for product_id in candidates:
+                title_words = self._words[product_id]
+                score = sum(self._word_score(word, grams, title_words)
+                            for word, grams in query_words) / len(query_words)
+                if score >= threshold:
+                    scored.append((score, product_id))
+        return [(product_id, score) for score, product_id in heapq.nlargest(limit, scored)]
+
+
+class PrefixIndex(TitleIndex):
+    """
+    Array ordenado de (sufijo normalizado del título, product_id) para autocompletar: cada palabra
+    del título abre una entrada, así "monta" encuentra "Bicicleta de montaña". Las búsquedas son
+    un bisect más un recorrido acotado por el límite.
+    """
+
+    def _reset(self):
+        self._keys = []
+        self._products = {}
+        self._categories = Counter()
+        self._loading = True
+
+    def _add(self, product_id, title, category):
+        tokens = words(title)
+        keys = [' '.join(tokens[i:]) for i in range(len(tokens))]
+        for key in keys:
+            if self._loading:
+                self._keys.append((key, product_id))
+            else:
+                bisect.insort(self._keys, (key, product_id))
+        self._products[product_id] = (title, category, keys)
+        self._categories[category] += 1
+
+    def _finish_load(self):
+        self._keys.sort()
+        self._loading = False
+
+    def _remove(self, product_id):
+        entry = self._products.pop(product_id, None)
+        if entry is None:
+            return
+        _, category, keys = entry
+        for key in keys:
+            position = bisect.bisect_left(self._keys, (key, product_id))
+            if position < len(self._keys) and self._keys[position] == (key, product_id):
+                del self._keys[position]
+        self._categories[category] -= 1
+        if self._categories[category] <= 0:
+            del self._categories[category]
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        self.ensure_loaded()
+        prefix = ' '.join(words(prefix))
+        if not prefix:
+            return []
+        with self._lock:
+            results = [{"type": "category", "text": category}
+                       for category in sorted(self._categories)
+                       if any(key.startswith(prefix) for key in self._category_keys(category))][:limit]
+            seen = set()
+            position = bisect.bisect_left(self._keys, (prefix,))
+            while len(results) < limit and position < len(self._keys):
+                key, product_id = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                if product_id not in seen:
+                    seen.add(product_id)
+                    results.append({"type": "product", "id": product_id, "text": self._products[product_id][0]})
+                position += 1
+        return results
+
+    @staticmethod
+    def _category_keys(category):
+        tokens = words(category)
+        return [' '.join(tokens[i:]) for i in range(len(tokens))]
+
+
+ngram_index = NgramIndex()
+prefix_index = PrefixIndex()
+
+
+def index_product(product):
+    """Actualiza los índices en memoria tras crear o modificar `product` (después del commit)."""
+    ngram_index.add(product)
+    prefix_index.add(product)
+
+
+def unindex_product(product_id):
+    ngram_index.remove(product_id)
+    prefix_index.remove(product_id)
+
+
+def reindex_products(product_ids):
+    """Como index_product para varios productos (p.ej. reservados o liberados por un pedido), cargándolos
+    en una sola consulta. Llamar después del commit."""
+    product_ids = set(product_ids)
+    if not product_ids or (ngram_index._loaded_at is None and prefix_index._loaded_at is None):
+        return
+    products = Products.query.filter(Products.id.in_(product_ids)).all()
+    for product in products:
+        index_product(product)
+    for product_id in product_ids - {product.id for product in products}:
+        unindex_product(product_id)
+
+
+def fuzzy_search(query, search_query, ranked=True):
+    """Búsqueda tolerante a erratas ("iphnoe", "bicileta") y por prefijo sobre el título. Sin LIMIT: la
+    consulta se sigue componiendo (facetas, join con product_cards); quien la ejecuta aplica FUZZY_MAX_RESULTS."""
+    if dialect_name() == 'postgresql':
+        # Umbral de word_similarity para el operador <% solo en esta transacción
+        db.session.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+                           {"threshold": str(FUZZY_THRESHOLD)})
+        query = query.filter(or_(
+            literal(search_query).op('<%')(Products.title),
+            Products.title.ilike(f"%{escape_like(search_query)}%", escape='\\')
+        ))
+        if ranked:
+            similarity = func.word_similarity(search_query, Products.title)
+            query = query.order_by(similarity.desc(), Products.id.desc())
+        return query
+
+    # No se recorta a FUZZY_MAX_RESULTS aquí: el corte global se haría antes de los filtros de categoría,
+    # precio, zona... y dejaría fuera productos que sí los cumplen (y falsearía las facetas)
+    matches = ngram_index.search(search_query, limit=FUZZY_MAX_CANDIDATES)
+    if not matches:
+        return query.filter(db.false())
+    query = query.filter(Products.id.in_([product_id for product_id, _ in matches]))
+    if ranked:
+        position = {product_id: index for index, (product_id, _) in enumerate(matches)}
+        query = query.order_by(case(position, value=Products.id))
+    return query
@@ -1,4 +1,12 @@
+import base64
+import binascii
+import json
+from datetime import datetime
 from flask import jsonify, url_for
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_LIMIT = 20
+MAX_PAGE_LIMIT = 100
 
 
 class APIException(Exception):
@@ -17,6 +25,56 @@ class APIException(Exception):
         return rv
 
 
+def parse_limit(args, default=DEFAULT_PAGE_LIMIT):
+    raw = args.get('limit', '').strip()
+    if not raw:
+        return min(default, MAX_PAGE_LIMIT)
+    try:
+        limit = int(raw)
+    except ValueError:
+        limit = None
+    if limit is None or limit < 1:
+        raise APIException("El parámetro limit debe ser un entero positivo.")
+    return min(limit, MAX_PAGE_LIMIT)
+
+
+def encode_cursor(values):
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [datetime.fromisoformat(value) if column.type.python_type is datetime else value
+                for value, column in zip(values, columns)]
+    except (ValueError, TypeError, binascii.Error):
+        raise APIException("Cursor inválido.")
+
+
+def paginate_keyset(query, columns, cursor=None, limit=DEFAULT_PAGE_LIMIT, descending=True, row_values=None):
+    """
+    Pagina por clave (keyset) sobre `columns`, que deben formar una clave única (p.ej. created_at, id).
+    Devuelve (filas, next_cursor); next_cursor es None en la última página.
+    """
+    if cursor:
+        boundary = tuple_(*decode_cursor(cursor, columns))
+        key = tuple_(*columns)
+        query = query.filter(key < boundary if descending else key > boundary)
+    order = [column.desc() if descending else column.asc() for column in columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = row_values(rows[-1]) if row_values else [getattr(rows[-1], column.key) for column in columns]
+        next_cursor = encode_cursor(last)
+    return rows, next_cursor
+
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
@@ -0,0 +1,248 @@
+"""
+Ingesta de webhooks de Stripe. La ruta solo verifica la firma y guarda el evento en stripe_events
+(clave = id del evento, así que las entregas repetidas se ignoran) y contesta 200 enseguida. Un
+PollingWorker procesa el inbox en segundo plano, de forma idempotente, y actualiza pedidos y productos.
+
+Variables: STRIPE_WORKER_THREADS (1; 0 desactiva el worker en proceso y hay que usar
+`flask process-stripe-events`), STRIPE_EVENTS_BATCH_SIZE (20), STRIPE_EVENTS_MAX_ATTEMPTS (8).
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from api.models import db, Users, Products, ProductCards, Orders, OrderItems, StripeEvents
+from api.cache import invalidate_product
+from api.orders import release_order
+from api.payments import get_gateway
+from api.search import reindex_products
+from api.workers import PollingWorker, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 20
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 15
+BACKOFF_MAX_SECONDS = 3600
+LEASE_SECONDS = 300
+
+
+def record_event(event):
+    """Guarda el evento verificado en el inbox. Devuelve False si ya se había recibido."""
+    if db.session.get(StripeEvents, event['id']) is not None:
+        return False
+    db.session.add(StripeEvents(id=event['id'], type=event['type'], payload=event))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Otra entrega simultánea del mismo evento ha llegado antes
+        db.session.rollback()
+        return False
+    return True
+
+
+def notify_webhooks():
+    worker = current_app.extensions.get('stripe_events')
+    if worker is not None:
+        worker.wake()
+
+
+def intent_user_id(metadata):
+    user_id = metadata.get('user_id')
+    if user_id is not None and str(user_id).isdigit():
+        return int(user_id)
+    # Intents antiguos guardaban el email (identidad del JWT) en lugar del id
+    user = Users.query.filter_by(email=user_id).first() if user_id else None
+    return user.id if user else None
+
+
+def order_for_intent(intent):
+    """Pedido asociado al PaymentIntent: por payment_intent_id, por el order_id de la metadata, o el
+    pedido pendiente del usuario que contiene el producto, o uno nuevo con ese producto (compra
+    directa desde la ficha)."""
+    order = Orders.query.filter_by(payment_intent_id=intent['id']).first()
+    if order is not None:
+        return order, []
+
+    metadata = intent.get('metadata') or {}
+    if metadata.get('order_id'):
+        order = db.session.get(Orders, int(metadata['order_id']))
+        if order is None:
+            raise ValueError(f"PaymentIntent {intent['id']} de un pedido inexistente")
+        return order, []
+
+    user_id = intent_user_id(metadata)
+    product_id = int(metadata['product_id']) if metadata.get('product_id') else None
+    if user_id is None or product_id is None:
+        raise ValueError(f"PaymentIntent {intent['id']} sin user_id/product_id en metadata")
+
+    order = Orders.query.join(OrderItems, OrderItems.order_id == Orders.id)\
+        .filter(Orders.user_id == user_id, Orders.status == 'pending', Orders.payment_intent_id.is_(None),
+                OrderItems.product_id == product_id)\
+        .order_by(Orders.id.desc()).first()
+    if order is not None:
+        return order, []
+
+    now = datetime.utcnow()
+    total = intent['amount'] / 100
+    order = Orders(user_id=user_id, status='pending', created_at=now, total=total)
+    db.session.add(order)
+    db.session.flush()
+    item = OrderItems(order_id=order.id, product_id=product_id, total=total)
+    db.session.add(item)
+    return order, [item]
+
+
+def payment_conflict(order, products, product_ids, new_order):
+    """Motivo por el que un pago recibido no puede completar el pedido, o None si se puede marcar pagado.
+    Los productos de un pedido pendiente deben seguir reservados por él; los de una compra directa,
+    disponibles."""
+    if order.status != 'pending':
+        return f"pedido en estado {order.status}"
+    if len(products) != len(product_ids):
+        return "algún producto ya no existe"
+    if any(product.was_sold for product in products):
+        return "algún producto ya está vendido"
+    if new_order and not all(product.available for product in products):
+        return "algún producto está reservado o retirado"
+    if not new_order and any(product.reserved_order_id != order.id for product in products):
+        return "algún producto ya no está reservado para el pedido"
+    return None
+
+
+def handle_payment_succeeded(intent):
+    order, new_items = order_for_intent(intent)
+    if order.payment_intent_id == intent['id'] and order.status in ('paid', 'refund_needed'):
+        return []
+    if order.status == 'paid':
+        # Segundo cobro de un pedido ya pagado con otro intent: no hay dónde anotarlo en el pedido
+        logger.error("Pago duplicado de un pedido ya pagado; requiere reembolso",
+                     extra={"order_id": order.id, "payment_intent_id": intent['id']})
+        return []
+
+    product_ids = {item.product_id for item in list(order.items) + new_items}
+    products = Products.query.filter(Products.id.in_(product_ids))\
+        .order_by(Products.id).with_for_update().all()
+    order.payment_intent_id = intent['id']
+    order.paid_at = datetime.utcnow()
+    reason = payment_conflict(order, products, product_ids, bool(new_items))
+    if reason:
+        # No se venden productos liberados o reservados por otro comprador: el pago queda para reembolsar
+        order.status = 'refund_needed'
+        logger.error("Pago recibido para un pedido que no se puede completar; requiere reembolso",
+                     extra={"order_id": order.id, "payment_intent_id": intent['id'], "reason": reason})
+        return []
+
+    order.status = 'paid'
+    # Venta condicional (en SQLite no hay FOR UPDATE): si otro proceso ha cambiado los productos entre
+    # la comprobación y aquí, se lanza y el reintento del evento lo anotará como conflicto
+    condition = [Products.id.in_(product_ids), or_(Products.was_sold.is_(False), Products.was_sold.is_(None))]
+    condition.append(Products.available.is_(True) if new_items else Products.reserved_order_id == order.id)
+    sold = Products.query.filter(*condition)\
+        .update({Products.was_sold: True,
+                 Products.available: False,
+                 Products.reserved_order_id: None,
+                 Products.version: Products.version + 1,
+                 Products.updated_at: datetime.utcnow()}, synchronize_session=False)
+    if sold != len(product_ids):
+        raise RuntimeError(f"Los productos del pedido {order.id} han cambiado durante el cobro")
+    for product in products:
+        db.session.expire(product)
+        ProductCards.refresh(product)
+    return [(product.id, product.user_id) for product in products]
+
+
+def handle_payment_canceled(intent):
+    metadata = intent.get('metadata') or {}
+    # El próximo intento de pago del comprador debe crear un intent nuevo, no devolver este
+    user_id = intent_user_id(metadata)
+    reference = {name: metadata[name] for name in ('order_id', 'product_id') if metadata.get(name)}
+    if user_id is not None and reference:
+        get_gateway().forget_intent(intent['id'], user_id, intent['amount'], **reference)
+
+    order = Orders.query.filter_by(payment_intent_id=intent['id']).first()
+    if order is None and metadata.get('order_id'):
+        order = db.session.get(Orders, int(metadata['order_id']))
+    if order is None or order.status != 'pending':
+        return []
+    released = release_order(order)
+    order.status = 'canceled'
+    return released
+
+
+EVENT_HANDLERS = {
+    'payment_intent.succeeded': handle_payment_succeeded,
+    'payment_intent.canceled': handle_payment_canceled,
+}
+
+
+def claim_batch(limit):
+    now = datetime.utcnow()
+    events = StripeEvents.query.filter(
+        StripeEvents.status.in_(['pending', 'processing']),
+        StripeEvents.next_attempt_at <= now
+    ).order_by(StripeEvents.received_at, StripeEvents.id)\
+        .with_for_update(skip_locked=True).limit(limit).all()
+    for event in events:
+        event.status = 'processing'
+        event.attempts += 1
+        event.next_attempt_at = now + timedelta(seconds=LEASE_SECONDS)
+    db.session.commit()
+    return [event.id for event in events]
+
+
+def process_event(event, max_attempts):
+    handler = EVENT_HANDLERS.get(event.type)
+    if handler is None:
+        event.status = 'ignored'
+        event.processed_at = datetime.utcnow()
+        db.session.commit()
+        return
+    try:
+        touched = handler(event.payload['data']['object'])
+        event.status = 'processed'
+        event.processed_at = datetime.utcnow()
+        event.last_error = None
+        db.session.commit()
+    except Exception as error:
+        db.session.rollback()
+        event = db.session.get(StripeEvents, event.id)
+        event.last_error = str(error)[:1000]
+        if event.attempts >= max_attempts:
+            event.status = 'failed'
+            logger.exception("Evento de Stripe descartado tras agotar los reintentos",
+                             extra={"event_id": event.id, "type": event.type})
+        else:
+            event.status = 'pending'
+            event.next_attempt_at = datetime.utcnow() + backoff_delay(event.attempts, BACKOFF_BASE_SECONDS,
+                                                                      BACKOFF_MAX_SECONDS)
+            logger.warning("Fallo al procesar evento de Stripe, se reintentará",
+                           extra={"event_id": event.id, "type": event.type, "error": event.last_error})
+        db.session.commit()
+        return
+    for product_id, user_id in touched:
+        invalidate_product(product_id, user_id)
+    reindex_products(product_id for product_id, _ in touched)
+
+
+def process_pending(app, batch_size=None, max_attempts=None):
+    """Procesa un lote del inbox. Devuelve el número de eventos procesados."""
+    batch_size = batch_size or int(os.getenv('STRIPE_EVENTS_BATCH_SIZE', BATCH_SIZE))
+    max_attempts = max_attempts or int(os.getenv('STRIPE_EVENTS_MAX_ATTEMPTS', MAX_ATTEMPTS))
+    event_ids = claim_batch(batch_size)
+    for event_id in event_ids:
+        process_event(db.session.get(StripeEvents, event_id), max_attempts)
+    return len(event_ids)
+
+
+def setup_webhooks(app):
+    threads = int(os.getenv('STRIPE_WORKER_THREADS', 1))
+    if threads > 0:
+        app.extensions['stripe_events'] = PollingWorker(app, 'stripe-events', process_pending,
+                                                        interval=float(os.getenv('STRIPE_EVENTS_POLL_INTERVAL', 10)),
+                                                        threads=threads)
+
+        @app.before_request
+        def start_stripe_events():
+            app.extensions['stripe_events'].start()
@@ -0,0 +1,72 @@
+"""
+Workers de fondo genéricos: hilos que ejecutan periódicamente una función `handler(app)` dentro del
+contexto de la aplicación. `handler` devuelve cuántos elementos ha procesado; si ha procesado alguno
+se vuelve a llamar enseguida (hay más trabajo), si no se espera `interval` segundos o hasta `wake()`.
+"""
+import logging
+import random
+import threading
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def backoff_delay(attempts, base, maximum):
+    """Espera antes del siguiente reintento: exponencial con tope y ±20% de jitter."""
+    delay = min(base * 2 ** (attempts - 1), maximum)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+class PollingWorker:
+    def __init__(self, app, name, handler, interval=5.0, threads=1):
+        self.app = app
+        self.name = name
+        self.handler = handler
+        self.interval = interval
+        self.threads = threads
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Arranca los hilos (idempotente). Se llama de forma perezosa para no crear hilos en la CLI."""
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.threads):
+                thread = threading.Thread(target=self._loop, name=f"{self.name}-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_forever(self):
+        """Ejecuta el bucle en el hilo actual (p.ej. un proceso worker dedicado lanzado desde la CLI)."""
+        self._loop()
+
+    def run_once(self):
+        with self.app.app_context():
+            return self.handler(self.app)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                processed = self.run_once()
+            except Exception:
+                logger.exception("Error en el worker", extra={"worker": self.name})
+                processed = 0
+            if not processed:
+                self._wake.wait(self.interval)
+                self._wake.clear()
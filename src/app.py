@@ -10,6 +10,14 @@ from api.models import db
 from api.routes import api
 from api.admin import setup_admin
 from api.commands import setup_commands
+from api.cache import setup_cache
+from api.realtime import setup_realtime
+from api.logs import setup_logging
+from api.mailer import setup_mailer
+from api.payments import setup_payments
+from api.webhooks import setup_webhooks
+from api.passwords import setup_passwords
+from api.ratelimit import setup_rate_limits
 from flask_jwt_extended import JWTManager
 from datetime import timedelta
 from flask_mail import Mail, Message
@@ -22,6 +30,7 @@ ENV = "development" if os.getenv("FLASK_DEBUG") == "1" else "production"
 static_file_dir = os.path.join(os.path.dirname(
     os.path.realpath(__file__)), '../dist/')
 app = Flask(__name__)
+setup_logging(app)  # Structured, non-blocking logging with request ids
 app.url_map.strict_slashes = False
 # Database condiguration
 db_url = os.getenv("DATABASE_URL")
@@ -36,6 +45,12 @@ db.init_app(app)
 # Other configuration
 setup_admin(app)  # Add the admin
 setup_commands(app)  # Add the admin
+setup_cache(app)  # Response cache for anonymous catalog reads
+setup_realtime(app)  # Broker for the messages event stream
+setup_payments(app)  # Pooled Stripe client with timeouts and circuit breaker
+setup_webhooks(app)  # Background processing of the Stripe events inbox
+setup_passwords(app)  # Password hashing with configurable cost on a bounded thread pool
+setup_rate_limits(app)  # Token-bucket limits for login, registration and password recovery
 # Add all endpoints form the API with a "api" prefix
 app.register_blueprint(api, url_prefix='/api')
 # Setup the Flask-JWT-Extended extension
@@ -50,6 +65,7 @@ app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER')
 mail = Mail(app)
+setup_mailer(app)  # Background sender for the email outbox
 
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
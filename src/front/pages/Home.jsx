@@ -40,24 +40,26 @@ export const Home = () => {
     }
   };
 
-  const checkFavoriteStatus = async (productId) => {
+  // Estado de favorito de todos los productos en una sola petición: { [productId]: favoriteId | null }
+  const checkFavoriteStatuses = async (productIds) => {
     const token = localStorage.getItem('token');
-    if (!token) return { is_favorite: false };
-    
+    if (!token || productIds.length === 0) return {};
+
     try {
-      const response = await fetch(`${API_URL}/api/favorites/check/${productId}`, {
+      const response = await fetch(`${API_URL}/api/favorites/check?ids=${productIds.join(',')}`, {
         headers: {
           'Authorization': `Bearer ${token}`
         }
       });
-      
+
       if (response.ok) {
-        return await response.json();
+        const data = await response.json();
+        return data.results || {};
       }
-      return { is_favorite: false };
+      return {};
     } catch (error) {
       console.error("Error checking favorite status:", error);
-      return { is_favorite: false };
+      return {};
     }
   };
 
@@ -79,16 +81,14 @@ export const Home = () => {
 
       const token = localStorage.getItem('token');
       if (token) {
-        const statusPromises = products.map(product => 
-          checkFavoriteStatus(product.id)
-        );
-        const statusResults = await Promise.all(statusPromises);
-        
+        const statusResults = await checkFavoriteStatuses(products.map(product => product.id));
+
         const newFavoriteStatus = {};
-        statusResults.forEach((result, index) => {
-          newFavoriteStatus[products[index].id] = {
-            isFavorite: result.is_favorite,
-            favoriteId: result.favorite_id
+        products.forEach(product => {
+          const favoriteId = statusResults[product.id];
+          newFavoriteStatus[product.id] = {
+            isFavorite: Boolean(favoriteId),
+            favoriteId: favoriteId || undefined
           };
         });
         setFavoriteStatus(newFavoriteStatus);
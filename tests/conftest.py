@@ -0,0 +1,66 @@
+"""
+Fixtures de pytest: la app de src/app.py sobre una base SQLite temporal (tablas con db.create_all) y sin
+workers en segundo plano. Ejecutar desde la raíz del repositorio con `python -m pytest`.
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+DB_DIR = tempfile.mkdtemp(prefix='api-tests-')
+# src/app.py lee la configuración al importarse
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(DB_DIR, 'test.db')}",
+    JWT_SECRET_KEY='test-secret-key-with-at-least-32-bytes',
+    FLASK_APP_KEY='test',
+    EMAIL_WORKER_THREADS='0',
+    STRIPE_WORKER_THREADS='0',
+    RESPONSE_CACHE_BACKEND='none',
+)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src'))
+
+from app import app as flask_app  # noqa: E402
+from api.models import db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def count_queries(app):
+    """Context manager que cuenta las sentencias SQL ejecutadas dentro del bloque."""
+    @contextmanager
+    def counting():
+        counter = QueryCounter()
+        event.listen(db.engine, 'before_cursor_execute', counter)
+        try:
+            yield counter
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', counter)
+    return counting
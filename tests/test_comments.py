@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from api.models import db, Users, Comments
+
+
+def create_profile(comment_count):
+    profile = Users(first_name='Ana', last_name='Vendedora', email=f'ana{comment_count}@example.com', password='x',
+                    role='vendedor')
+    db.session.add(profile)
+    db.session.flush()
+    start = datetime(2026, 1, 1)
+    for n in range(comment_count):
+        # Un autor distinto por comentario: una carga perezosa de autores haría una consulta por fila
+        author = Users(first_name=f'Autor{n}', last_name='C', email=f'autor{comment_count}-{n}@example.com',
+                       password='x', role='comprador')
+        db.session.add(author)
+        db.session.flush()
+        db.session.add(Comments(content=f'Comentario {n}', user_id=author.id, profile_user_id=profile.id,
+                                created_at=start + timedelta(minutes=n)))
+    db.session.commit()
+    profile_id = profile.id
+    db.session.expunge_all()
+    return profile_id
+
+
+@pytest.mark.parametrize('query_string', ['', '?limit=100'])
+def test_profile_comments_query_count_does_not_grow(app, client, count_queries, query_string):
+    counts = {}
+    for comment_count in (2, 12, 42):
+        profile_id = create_profile(comment_count)
+        with count_queries() as queries:
+            response = client.get(f'/api/comments/profile/{profile_id}{query_string}')
+        assert response.status_code == 200
+        assert len(response.get_json()['results']) == comment_count
+        assert all(comment['user_name'].startswith('Autor') for comment in response.get_json()['results'])
+        counts[comment_count] = len(queries)
+    assert len(set(counts.values())) == 1, counts
+
+
+def test_profile_comments_pagination(app, client):
+    profile_id = create_profile(5)
+    response = client.get(f'/api/comments/profile/{profile_id}?limit=2')
+    page = response.get_json()
+    assert [comment['content'] for comment in page['results']] == ['Comentario 4', 'Comentario 3']
+    next_page = client.get(f"/api/comments/profile/{profile_id}?limit=2&cursor={page['pagination']['next_cursor']}")
+    assert [comment['content'] for comment in next_page.get_json()['results']] == ['Comentario 2', 'Comentario 1']
@@ -0,0 +1,48 @@
+import pytest
+from flask_jwt_extended import create_access_token
+
+from api.models import db, Users, Products, ProductCards
+
+
+@pytest.fixture
+def buyer_headers(app):
+    seller = Users(first_name='Ana', last_name='V', email='seller@example.com', password='x', role='vendedor')
+    buyer = Users(first_name='Bob', last_name='C', email='buyer@example.com', password='x', role='comprador')
+    db.session.add_all([seller, buyer])
+    db.session.flush()
+    product = Products(title='Bicicleta', description='Bicicleta de montaña', price=150, location='Madrid',
+                       tags='used', category='Bicicletas', user_id=seller.id, was_sold=False)
+    db.session.add(product)
+    db.session.flush()
+    ProductCards.refresh(product)
+    db.session.commit()
+    token = create_access_token(identity=buyer.email, additional_claims={'user_id': buyer.id, 'role': buyer.role})
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.mark.parametrize('body', [
+    {},
+    {'order_items': 'abc'},
+    {'order_items': {'product_id': 1}},
+    {'order_items': [5]},
+    {'order_items': []},
+    {'order_items': [{}]},
+    {'order_items': [{'product_id': 'abc'}]},
+    {'order_items': [{'product_id': None}]},
+    {'order_items': [{'product_id': True}]},
+    {'order_items': [{'product_id': 0}]},
+    {'order_items': [{'product_id': -3}]},
+    {'order_items': [{'product_id': 1.5}]},
+    {'order_items': [{'product_id': [1]}]},
+])
+def test_create_order_rejects_invalid_items(client, buyer_headers, body):
+    response = client.post('/api/orders', json=body, headers=buyer_headers)
+    assert response.status_code == 400
+    assert response.get_json()['message']
+
+
+def test_create_order_reserves_product(client, buyer_headers):
+    response = client.post('/api/orders', json={'order_items': [{'product_id': '1'}]}, headers=buyer_headers)
+    assert response.status_code == 201
+    assert response.get_json()['results']['status'] == 'pending'
+    assert db.session.get(Products, 1).available is False
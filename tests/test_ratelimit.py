@@ -0,0 +1,31 @@
+import pytest
+
+from api.models import db, Users
+from api.passwords import hash_password
+from api.ratelimit import LocalBucketStore
+
+
+@pytest.fixture
+def login(app, client):
+    app.config.update(RATE_LIMIT_LOGIN_IP='100/60', RATE_LIMIT_LOGIN_EMAIL='2/3600')
+    app.extensions['rate_limits'] = LocalBucketStore()
+    db.session.add(Users(first_name='Ana', last_name='V', email='ana@example.com', password=hash_password('secret'),
+                         role='vendedor', is_active=True))
+    db.session.commit()
+
+    def attempt(password, ip):
+        return client.post('/api/login', json={'email': 'ana@example.com', 'password': password},
+                           environ_base={'REMOTE_ADDR': ip}).status_code
+    return attempt
+
+
+def test_successful_logins_do_not_use_the_email_bucket(login):
+    assert [login('secret', '10.0.0.1') for _ in range(4)] == [200] * 4
+
+
+def test_failed_logins_lock_the_email_only_from_that_network(login):
+    assert [login('wrong', '203.0.113.7') for _ in range(3)] == [401, 401, 429]
+    # Misma red /24 del atacante: bloqueada también con la contraseña correcta
+    assert login('secret', '203.0.113.99') == 429
+    # El dueño de la cuenta desde otra red sigue pudiendo entrar
+    assert login('secret', '198.51.100.4') == 200